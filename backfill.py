@@ -0,0 +1,158 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from database import CandleData
+from interfaces.logging_component import logger
+import json
+import os
+from strategies import TF_EQUIV
+import time
+import typing
+if typing.TYPE_CHECKING:
+    from coinbase import CoinbaseClient
+
+# Coinbase returns at most 300 candles per request
+PAGE_SIZE = 300
+
+
+class HistoryBackfill:
+    """Downloads the candle history of many products and granularities between start and end (unix timestamps).
+    Every (product, granularity) range is cut into pages of 300 candles, the pages are requested on a thread pool (the
+    RateLimiter of the client keeps all the threads under the REST limit together) and written to candles.db in bulk.
+
+    Finished pages are recorded in a checkpoint file after they are written, so running the same job again after an
+    interruption only downloads what is missing. The last page of a range, cut short by end, is never recorded: a later
+    job with a later end downloads it again whole (the candles already stored are replaced)."""
+    def __init__(self, coinbase: "CoinbaseClient", symbols: typing.List[str], start: int, end: int = None,
+                 granularities: typing.List[str] = None, max_workers: int = 8,
+                 checkpoint_path: str = 'backfill_checkpoint.json', db: CandleData = None, write_size: int = 20000):
+        self.coinbase = coinbase
+        self.symbols = symbols
+        self.granularities = granularities if granularities is not None else list(TF_EQUIV.keys())
+        self.start = int(start)
+        self.end = int(end) if end is not None else int(time.time())
+        self.max_workers = max_workers
+        self.checkpoint_path = checkpoint_path
+        self.db = db if db is not None else CandleData()
+        self.write_size = write_size
+
+        self._completed: typing.Set[str] = self._load_checkpoint()
+
+    @staticmethod
+    def _page_key(symbol: str, granularity: str, page_start: int) -> str:
+        return f'{symbol}|{granularity}|{page_start}'
+
+    def _load_checkpoint(self) -> typing.Set[str]:
+        if not os.path.exists(self.checkpoint_path):
+            return set()
+        with open(self.checkpoint_path) as f:
+            return set(json.load(f)['completed'])
+
+    def _save_checkpoint(self):
+        # write then rename so a crash while saving never leaves a half written checkpoint
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'completed': sorted(self._completed)}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def pages(self) -> typing.List[typing.Tuple[str, str, int, int]]:
+        """Every (symbol, granularity, page_start, page_end) of the job that is not in the checkpoint yet."""
+        pages = []
+        for symbol in self.symbols:
+            for granularity in self.granularities:
+                page_length = PAGE_SIZE * TF_EQUIV[granularity]
+                # align on the granularity so a resumed job cuts the range into the same pages
+                page_start = self.start - self.start % TF_EQUIV[granularity]
+                while page_start < self.end:
+                    page_end = min(page_start + page_length, self.end)
+                    if self._page_key(symbol, granularity, page_start) not in self._completed:
+                        pages.append((symbol, granularity, page_start, page_end))
+                    page_start += page_length
+        return pages
+
+    def _fetch_page(self, symbol: str, granularity: str, page_start: int, page_end: int, retries: int = 3):
+        for attempt in range(retries):
+            candles = self.coinbase.get_candles_range(symbol, granularity, page_start, page_end)
+            if candles is not None:
+                return candles
+            time.sleep(2 ** attempt)
+        return None
+
+    def run(self) -> typing.Dict[str, float]:
+        """Runs the job and returns a summary (pages, failed pages, candles written, seconds, candles per second)."""
+        pages = self.pages()
+        total = len(pages)
+        logger.info(f'Backfill: {total} pages to download for {len(self.symbols)} products and '
+                    f'{len(self.granularities)} granularities ({len(self._completed)} already done)')
+
+        started = time.time()
+        last_report = started
+        done = 0
+        failed = 0
+        candles_written = 0
+
+        rows = []
+        written_pages = []
+
+        def write():
+            nonlocal rows, written_pages, candles_written
+            if len(rows) > 0 or len(written_pages) > 0:
+                self.db.save_candles(rows)
+                candles_written += len(rows)
+                self._completed.update(written_pages)
+                self._save_checkpoint()
+            rows = []
+            written_pages = []
+
+        # only a few pages per thread are submitted at a time, an interrupted job (Ctrl+C, an error) doesn't wait for
+        # the whole queue to download and the pages finished so far are written and checkpointed in the finally
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        remaining = iter(pages)
+        in_flight: typing.Dict = dict()
+
+        try:
+            while True:
+                while len(in_flight) < 2 * self.max_workers:
+                    page = next(remaining, None)
+                    if page is None:
+                        break
+                    in_flight[executor.submit(self._fetch_page, *page)] = page
+                if len(in_flight) == 0:
+                    break
+
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    symbol, granularity, page_start, page_end = in_flight.pop(future)
+                    candles = future.result()
+                    done += 1
+
+                    if candles is None:
+                        failed += 1
+                        logger.warning(f'Backfill: page {symbol} {granularity} starting at {page_start} failed, it '
+                                       f'will be retried on the next run')
+                    else:
+                        for candle in candles:
+                            rows.append((symbol, granularity, candle.timestamp, candle.open, candle.high, candle.low,
+                                         candle.close, candle.volume))
+                        if page_end - page_start == PAGE_SIZE * TF_EQUIV[granularity]:
+                            written_pages.append(self._page_key(symbol, granularity, page_start))
+
+                    if len(rows) >= self.write_size:
+                        write()
+
+                    if time.time() - last_report >= 5 or done == total:
+                        last_report = time.time()
+                        elapsed = last_report - started
+                        rate = done / elapsed if elapsed > 0 else 0
+                        logger.info(f'Backfill: {done}/{total} pages | {candles_written + len(rows)} candles | '
+                                    f'{rate:.1f} pages/s | ETA {(total - done) / rate if rate > 0 else 0:.0f}s')
+        finally:
+            for future in in_flight:
+                future.cancel()
+            executor.shutdown(wait=False)
+            write()
+
+        elapsed = time.time() - started
+        summary = {'pages': total, 'failed_pages': failed, 'candles': candles_written, 'seconds': elapsed,
+                   'candles_per_second': candles_written / elapsed if elapsed > 0 else 0}
+        logger.info(f'Backfill finished: {summary}')
+
+        return summary
@@ -0,0 +1,110 @@
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+from interfaces.logging_component import logger
+from strategies import TF_EQUIV, evaluate_signals
+import threading
+import time
+import typing
+if typing.TYPE_CHECKING:
+    from strategies import Strategy
+
+
+class CandleClock:
+    """Closes the candles of every running strategy exactly at the interval boundaries instead of waiting for the next
+    trade, which can be minutes late on a thin book.
+
+    All the series of a timeframe close on the same boundary, so the clock keeps one bucket of strategies per timeframe
+    and a heap with the next boundary of each active timeframe (8 entries at most). A single timer thread sleeps until
+    the earliest boundary, so each tick costs O(1) per series that closes, no matter how many series are running."""
+    def __init__(self, max_workers: int = 4):
+        # timeframe -> strategies on that timeframe
+        self._buckets: typing.Dict[str, typing.Set["Strategy"]] = dict()
+        # (next boundary, timeframe) of every timeframe with at least one strategy
+        self._heap: typing.List[typing.Tuple[int, str]] = []
+
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+        # signal evaluation and the orders it places run here so the timer thread is never late for the next boundary
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    @staticmethod
+    def _next_boundary(timeframe: str, now: float) -> int:
+        interval = TF_EQUIV[timeframe]
+        return (int(now) // interval + 1) * interval
+
+    def add(self, strategy: "Strategy"):
+        with self._condition:
+            if strategy.timeframe not in self._buckets:
+                self._buckets[strategy.timeframe] = set()
+                heapq.heappush(self._heap, (self._next_boundary(strategy.timeframe, time.time()), strategy.timeframe))
+                # the new boundary may be earlier than the one the timer thread is sleeping on
+                self._condition.notify()
+            self._buckets[strategy.timeframe].add(strategy)
+
+    def remove(self, strategy: "Strategy"):
+        with self._condition:
+            self._buckets.get(strategy.timeframe, set()).discard(strategy)
+            # the empty bucket stays in the heap until its next boundary, _run drops it there
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+
+        self._thread = threading.Thread(target=self._run, name='candle-clock', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and (len(self._heap) == 0 or self._heap[0][0] > time.time()):
+                    timeout = self._heap[0][0] - time.time() if len(self._heap) > 0 else None
+                    self._condition.wait(timeout)
+
+                if not self._running:
+                    return
+
+                boundary, timeframe = heapq.heappop(self._heap)
+                strategies = list(self._buckets.get(timeframe, set()))
+
+                if len(strategies) > 0:
+                    heapq.heappush(self._heap, (boundary + TF_EQUIV[timeframe], timeframe))
+                else:
+                    del self._buckets[timeframe]
+
+            if len(strategies) > 0:
+                self._close(boundary, strategies)
+
+    def _close(self, boundary: int, strategies: typing.List["Strategy"]):
+        closed = [strategy for strategy in strategies if strategy.close_candle(boundary)]
+
+        if len(closed) > 0:
+            logger.debug(f'Candle clock closed {len(closed)} candles on the {closed[0].timeframe} boundary {boundary}')
+            self._executor.submit(self._evaluate, closed)
+
+    def _evaluate(self, strategies: typing.List["Strategy"]):
+        """Evaluates all the strategies that closed a candle on the same boundary together (see evaluate_signals) and
+        sends the entries to the pool, one strategy's order doesn't hold back the others."""
+        try:
+            signals = evaluate_signals([strategy for strategy in strategies if not strategy.ongoing_position])
+        except Exception as err:
+            logger.error(f'Error while evaluating the signals on candle close: {err}')
+            return
+
+        for strategy, signal_result in signals.items():
+            if signal_result in [-1, 1]:
+                self._executor.submit(self._on_signal, strategy, signal_result)
+
+    @staticmethod
+    def _on_signal(strategy: "Strategy", signal_result: int):
+        try:
+            strategy.on_signal(signal_result)
+        except Exception as err:
+            logger.error(f'Error while opening a position on {strategy.asset.symbol} {strategy.timeframe}: {err}')
@@ -1,45 +1,89 @@
 from models import *
-import dateutil.parser
+from candle_clock import CandleClock
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
 import hmac
+from indicator_service import IndicatorService
 import json
 from interfaces.logging_component import logger
+from market_data import MarketDataFeed
 import numpy as np
+from order_gateway import OrderGateway, PRIORITY_DEFAULT, PRIORITY_ENTRY, PRIORITY_STOP_LOSS
+from paper_trading import PaperExecution
+from rate_limiter import RateLimiter
 import requests
-from strategies import TechnicalStrategy, BreakoutStrategy
-import threading
+from risk import RiskLimits, RiskManager
+from strategies import Strategy
+from triggers import TriggerIndex
 import time
 import typing
-import websocket
 
 
 class CoinbaseClient:
-    def __init__(self, public_key: str, secret_key: str):
-        self._public_key = public_key
-        self._secret_key = secret_key
-
-        self._base_url = 'https://api.coinbase.com'
-        self._ws_url = 'wss://advanced-trade-ws.coinbase.com'
+    def __init__(self, public_key: str, secret_key: str, start_ws: bool = True, paper: PaperExecution = None,
+                 feed: MarketDataFeed = None):
+        self._init_rest(public_key, secret_key, paper)
+        # websocket, product catalog, prices and trade tape, shared with the clients of other accounts created with
+        # the same feed (see market_data.py). The first client creates it and its keys sign the subscriptions
+        self.feed = feed if feed is not None else MarketDataFeed(self)
         # dict that contains the 'product-id' of each asset as a key and Asset object further defined in models.py
-        self.assets = self.get_assets()
-        # dictionary that has contract name ('BTC-USDT') as a key and values is a dict containing the best bid and ask
-        # price, the get_bid_ask method fills this dict
-        self.prices = dict()
+        self.assets = self.feed.assets
+        # table with the contract name ('BTC-USDT') as a key holding the best bid, ask and last price, filled by the
+        # websocket and the get_bid_ask method. It can still be used like the dict of dicts it used to be
+        self.prices = self.feed.prices
+        # every trade of the market_trades channel is archived here, see trade_tape.py for the query methods
+        self.tape = self.feed.tape
         # dict containing the product_id and your account balances represented by a Balance object (models.py) as value
         self.balances = self.get_balances()
         # dict that holds the strategy index as a key and a strategy object as a value
-        self.strategies: typing.Dict[int, typing.Union[TechnicalStrategy, BreakoutStrategy]] = dict()
+        self.strategies: typing.Dict[int, Strategy] = dict()
+        # indicator values shared by the strategies, computed once per candle for each (symbol, timeframe, params)
+        self.indicators = IndicatorService()
+        # closes the candles of the running strategies on time, strategies are added to it by the strategy editor
+        self.candle_clock = CandleClock()
+        self.candle_clock.start()
+        # take profit and stop loss levels of the open trades, checked against every trade of the feed
+        self.triggers = TriggerIndex()
 
-        self._ws = websocket.WebSocketApp
-        self._reconnect = True
+        self.logger.info('Coinbase Client successfully initialized')
+
+        self.feed.register(self)
+        if start_ws:
+            self.feed.start()
+
+    def _init_rest(self, public_key: str, secret_key: str, paper: PaperExecution = None):
+        """The REST side of the client: signed session, order gateway and risk checks. This is all the execution
+        process of the sharded mode builds (see sharding.py), the rest of __init__ is the market data side."""
+        self._public_key = public_key
+        self._secret_key = secret_key
+        # when set, orders and balances are simulated against the live feed instead of going to Coinbase
+        self.paper = paper
+
+        self._base_url = 'https://api.coinbase.com'
+        # seconds before a REST call is given up, a stuck connection must not hold a worker of the order gateway
+        self.request_timeout = 10
+        # Coinbase allows 30 requests per second on the private REST endpoints, every request waits on this bucket in
+        # the gateway's priority queue
+        self._rate_limiter = RateLimiter(30)
+        self.gateway = OrderGateway(self._send_request, self._rate_limiter)
+        # used by the batch order methods to send several requests at the same time
+        self._executor = ThreadPoolExecutor(max_workers=10)
+        # exit orders fired by the take profit and stop loss triggers, kept apart from _executor so they never wait
+        # behind the candle downloads of a resync or a batch of orders
+        self._exit_executor = ThreadPoolExecutor(max_workers=4)
+        # pre-trade risk checks done by every strategy before an entry order, limits are set in root_component.py
+        self.risk = RiskManager(RiskLimits())
 
         self.logger = logger
         self.logs = []
 
-        self.logger.info('Coinbase Client successfully initialized')
-
-        t = threading.Thread(target=self._start_ws)
-        t.start()
+    def close(self):
+        """Stops the client: it no longer gets the messages of the shared feed, and the feed is stopped (its tape
+        flushed) once no client uses it anymore."""
+        self.candle_clock.stop()
+        self.feed.unregister(self)
+        if len(self.feed.clients) == 0:
+            self.feed.stop()
 
     def _add_log(self, msg: str):
         self.logs.append({'log': msg, 'displayed': False})
@@ -55,8 +99,12 @@ class CoinbaseClient:
         signature = hmac.new(self._secret_key.encode(), message.encode(), hashlib.sha256).hexdigest()
         return signature
 
-    def _make_request(self, method: str, endpoint: str, data: typing.Dict):
-        """Method to make all requests."""
+    def _make_request(self, method: str, endpoint: str, data: typing.Dict, priority: int = PRIORITY_DEFAULT):
+        """Method to make all requests, they are queued by priority in the order gateway (see order_gateway.py)."""
+        return self.gateway.request(method, endpoint, data, priority)
+
+    def _send_request(self, method: str, endpoint: str, data: typing.Dict):
+        """Sends a request right away, only called by the order gateway."""
         timestamp = str(int(time.time()))
         headers = dict()
         headers['CB-ACCESS-KEY'] = self._public_key
@@ -66,21 +114,24 @@ class CoinbaseClient:
 
         if method == 'GET':
             try:
-                response = requests.get(self._base_url + endpoint, params=data, headers=headers)
+                response = requests.get(self._base_url + endpoint, params=data, headers=headers,
+                                        timeout=self.request_timeout)
             except Exception as err:
                 logger.error(f'Connection error while making {method} request to {endpoint}: {err}')
                 return None
 
         elif method == 'POST':
             try:
-                response = requests.post(self._base_url + endpoint, json=data, headers=headers)
+                response = requests.post(self._base_url + endpoint, json=data, headers=headers,
+                                         timeout=self.request_timeout)
             except Exception as err:
                 logger.error(f'Connection error while making {method} request to {endpoint}: {err}')
                 return None
 
         elif method == 'DELETE':
             try:
-                response = requests.delete(self._base_url + endpoint, params=data, headers=headers)
+                response = requests.delete(self._base_url + endpoint, params=data, headers=headers,
+                                           timeout=self.request_timeout)
             except Exception as err:
                 logger.error(f'Connection error while making {method} request to {endpoint}: {err}')
                 return None
@@ -110,8 +161,9 @@ class CoinbaseClient:
 
         return assets
 
-    def get_historical_candles(self, asset: Asset, interval: str) -> typing.List[Candle]:
-        """Creates a list of 300 Candle objects."""
+    def get_historical_candles(self, asset: Asset, interval: str, local: bool = False) -> typing.List[Candle]:
+        """Creates a list of 300 Candle objects. With local=True the candles are rebuilt from the trade tape instead of
+        requested from Coinbase, only the periods the bot was running for have trades on the tape."""
         timeframes = {'ONE_MINUTE': int(time.time() - 18000),
                       'FIVE_MINUTE': int(time.time() - 90000),
                       'FIFTEEN_MINUTE': int(time.time() - 270000),
@@ -125,35 +177,51 @@ class CoinbaseClient:
         data['end'] = int(time.time())
         data['granularity'] = interval
 
-        candles = []
-        raw_candles = self._make_request('GET', '/api/v3/brokerage/products/' + asset.symbol + '/candles', data)
+        if local:
+            return self.tape.candles(asset.symbol, interval, data['start'], data['end'])
 
-        if raw_candles is not None:
-            for raw_candle in raw_candles['candles']:
-                candles.append(Candle(raw_candle))
+        candles = self.get_candles_range(asset.symbol, interval, data['start'], data['end'])
+        return candles if candles is not None else []
+
+    def get_candles_range(self, symbol: str, interval: str, start: int, end: int) \
+            -> typing.Optional[typing.List[Candle]]:
+        """One request to the candles endpoint, Coinbase returns at most 300 candles (newest first) per request so
+        keep end - start <= 300 * the interval in seconds. Returns None if the request failed."""
+        data = dict()
+        data['start'] = int(start)
+        data['end'] = int(end)
+        data['granularity'] = interval
+
+        raw_candles = self._make_request('GET', '/api/v3/brokerage/products/' + symbol + '/candles', data)
+
+        if raw_candles is None:
+            return None
+
+        candles = []
+        for raw_candle in raw_candles['candles']:
+            candles.append(Candle(raw_candle))
 
         return candles
 
     def get_bid_ask(self, asset: Asset) -> typing.Dict[str, float]:
-        """Returns the specific bid/ask prices for the asset within the self.prices dict."""
+        """Returns a snapshot of the bid/ask prices for the asset from the self.prices table."""
         price_data = self._make_request('GET', '/api/v3/brokerage/products/' + asset.symbol + '/ticker', dict())
 
         if price_data is not None:
             try:
-                if asset.symbol not in self.prices:
-                    self.prices[asset.symbol] = {'bid': float(price_data['best_bid']),
-                                                 'ask': float(price_data['best_ask'])}
-                else:
-                    self.prices[asset.symbol]['bid'] = float(price_data['best_bid'])
-                    self.prices[asset.symbol]['ask'] = float(price_data['best_ask'])
+                self.prices.set_quote(asset.symbol, bid=float(price_data['best_bid']),
+                                      ask=float(price_data['best_ask']))
             except ValueError as err:
                 self.logger.error(f'Value error using get_bid_ask method: {err}')
 
-        return self.prices[asset.symbol]
+        return self.prices.snapshot(asset.symbol)
 
     def get_balances(self) -> typing.Dict[str, Balance]:
         """Creates a dictionary named balances where key is the asset symbol and the value is a Balance object defined
         in models.py"""
+        if self.paper is not None:
+            return self.paper.get_balances()
+
         list_of_balances = self._make_request('GET', '/api/v3/brokerage/accounts/', dict())
         balances = dict()
 
@@ -163,10 +231,15 @@ class CoinbaseClient:
 
         return balances
 
-    def place_order(self, asset: Asset, side: str, order_type: str, quantity: str, limit=None) -> OrderStatus:
+    def place_order(self, asset: Asset, side: str, order_type: str, quantity: float, limit: float = None,
+                    priority: int = PRIORITY_ENTRY) -> OrderStatus:
         """Place an order. For MARKET order, quantity is in quote currency for BUY orders and base currency for SELL
         orders. For LIMIT order quantity is amount of base currency and limit equals the ceiling price the order
-        should get filled."""
+        should get filled. Quantity and limit are rounded to the increments of the asset here. Exit orders pass
+        PRIORITY_STOP_LOSS or PRIORITY_TAKE_PROFIT as priority so they get ahead of the entries."""
+        if self.paper is not None:
+            return self.paper.place_order(asset, side, order_type, quantity, limit)
+
         data = dict()
         data['client_order_id'] = str(np.random.randint(2**63))
         data['product_id'] = asset.symbol
@@ -174,147 +247,208 @@ class CoinbaseClient:
 
         if side == 'BUY':
             if order_type == 'MARKET':
-                data['order_configuration'] = {'market_market_ioc': {'quote_size': quantity}}
+                data['order_configuration'] = {'market_market_ioc': {'quote_size': asset.format_price(float(quantity))}}
             elif order_type == 'LIMIT':
-                data['order_configuration'] = {'limit_limit_gtc': {'base_size': quantity,
-                                                                   'limit_price': limit,
+                data['order_configuration'] = {'limit_limit_gtc': {'base_size': asset.format_size(float(quantity)),
+                                                                   'limit_price': asset.format_price(float(limit)),
                                                                    'post_only': False}}
 
         elif side == 'SELL':
             if order_type == 'MARKET':
-                data['order_configuration'] = {'market_market_ioc': {'base_size': quantity}}
+                data['order_configuration'] = {'market_market_ioc': {'base_size': asset.format_size(float(quantity))}}
             elif order_type == 'LIMIT':
-                data['order_configuration'] = {'limit_limit_gtc': {'base_size': quantity,
-                                                                   'limit_price': limit,
+                data['order_configuration'] = {'limit_limit_gtc': {'base_size': asset.format_size(float(quantity)),
+                                                                   'limit_price': asset.format_price(float(limit)),
                                                                    'post_only': False}}
 
-        order = self._make_request('POST', '/api/v3/brokerage/orders', data)
+        order = self._make_request('POST', '/api/v3/brokerage/orders', data, priority)
 
-        if order['success'] is True:
+        if order is None:
+            return None
+        elif order['success'] is True:
             order_id = order['order_id']
             time.sleep(0.5)
-            order_status = self.get_order_status(order_id)
+            order_status = self.get_order_status(order_id, priority)
             return order_status
         else:
             print(order)
             self.logger.warning(f'Failure of place_order method for {data["side"]} order on {data["product_id"]}  due '
                                 f'to {order["error_response"]["message"]}')
 
-    def get_order_status(self, order_id: str) -> OrderStatus:
+    def get_order_status(self, order_id: str, priority: int = PRIORITY_DEFAULT) -> OrderStatus:
         """Takes a coinbase order_id and returns and OrderStatus object"""
-        order_status = self._make_request('GET', '/api/v3/brokerage/orders/historical/' + order_id, dict())
+        if self.paper is not None:
+            return self.paper.get_order_status(order_id)
+
+        order_status = self._make_request('GET', '/api/v3/brokerage/orders/historical/' + order_id, dict(), priority)
 
         if order_status is not None:
             order_status = OrderStatus(order_status['order'])
 
         return order_status
 
-    def cancel_order(self, order_id):
-        """Cancel an order or multiple orders by order_id"""
-        data = dict()
-        data['order_ids'] = [order_id]
+    def place_orders(self, orders: typing.List[typing.Dict]) -> typing.List[OrderStatus]:
+        """Place several orders at the same time. Each dict in orders holds the place_order arguments ('asset', 'side',
+        'order_type', 'quantity' and optionally 'limit' and 'priority'). The returned list is in the same order as
+        orders and holds None for every order that failed."""
+        futures = [self._executor.submit(self.place_order, order['asset'], order['side'], order['order_type'],
+                                         order['quantity'], order.get('limit'),
+                                         order.get('priority', PRIORITY_ENTRY)) for order in orders]
 
-        order = self._make_request('POST', "/api/v3/brokerage/orders/batch_cancel", data)
-
-        if order['results'][0]['success'] is not False:
-            time.sleep(0.5)
-            order_status = self.get_order_status(order['results'][0]['order_id'])
-            return order_status
-        else:
-            self.logger.warning(f'Failure of cancel_order method for order_id: {data["order_ids"]}')
-
-    def _start_ws(self):
-        self._ws = websocket.WebSocketApp(self._ws_url, on_open=self._on_open, on_close=self._on_close,
-                                          on_error=self._on_error, on_message=self._on_message)
-        while True:
+        results = []
+        for future in futures:
             try:
-                if self._reconnect:
-                    self._ws.run_forever()
-                else:
-                    break
-
+                results.append(future.result())
             except Exception as err:
-                self.logger.error(f'Coinbase websocket error in run_forever method: {err}')
-            time.sleep(2)
+                self.logger.error(f'Error while placing orders in batch: {err}')
+                results.append(None)
 
-    def _on_open(self, ws):
-        self.logger.info('Coinbase connection opened')
+        return results
 
-        self.subscribe_channel(list(self.assets.values())[:len(self.assets) - 2], 'ticker')
-        self.subscribe_channel(list(self.assets.values())[:len(self.assets) - 2], 'market_trades')
+    def cancel_order(self, order_id):
+        """Cancel a single order by order_id"""
+        return self.cancel_orders([order_id]).get(order_id)
 
-    def _on_close(self, ws):
-        self.logger.warning('Coinbase connection closed')
+    def cancel_orders(self, order_ids: typing.List[str]) -> typing.Dict[str, OrderStatus]:
+        """Cancel multiple orders by order_id. The ids are packed into batch_cancel requests of up to 100 ids (the
+        Coinbase maximum) and returns a dict with the order_id as key and the OrderStatus (None on failure) as value."""
+        if self.paper is not None:
+            return self.paper.cancel_orders(order_ids)
 
-    def _on_error(self, ws, msg: str):
-        self.logger.error(f'Coinbase connection error: {msg}')
+        batches = [order_ids[i:i + 100] for i in range(0, len(order_ids), 100)]
+        # cancels only take risk off, they go with the stop losses
+        futures = [self._executor.submit(self._make_request, 'POST', '/api/v3/brokerage/orders/batch_cancel',
+                                         {'order_ids': batch}, PRIORITY_STOP_LOSS) for batch in batches]
 
-    def _on_message(self, ws, msg: str):
-        """Currently fills the self.prices w/ the best bid/ask prices"""
-        data = json.loads(msg)
+        results = {order_id: None for order_id in order_ids}
+        cancelled = []
 
-        if 'channel' in data and data['channel'] == 'ticker':
-            symbol = data['events'][0]['tickers'][0]['product_id']
+        for batch, future in zip(batches, futures):
+            try:
+                response = future.result()
+            except Exception as err:
+                self.logger.error(f'Error while cancelling the order_ids {batch}: {err}')
+                continue
+            if response is None:
+                self.logger.warning(f'Failure of cancel_orders method for order_ids: {batch}')
+                continue
 
-            if symbol not in self.prices:
+            # a malformed response only loses its own batch, the ids of the other batches are still checked
+            try:
+                for result in response['results']:
+                    if result['success'] is not False:
+                        cancelled.append(result['order_id'])
+                    else:
+                        self.logger.warning(f'Failure of cancel_orders method for order_id: {result["order_id"]}')
+            except (KeyError, TypeError) as err:
+                self.logger.error(f'Unexpected batch_cancel response for order_ids {batch}: {err} {response}')
+
+        if len(cancelled) > 0:
+            time.sleep(0.5)
+            for order_id, order_status in zip(cancelled, self._executor.map(self.get_order_status, cancelled)):
+                results[order_id] = order_status
+
+        return results
+
+    def flatten_strategy(self, strategy_index: int) -> typing.Dict[int, OrderStatus]:
+        """Close every open trade of one strategy at market, see _flatten."""
+        return self._flatten([self.strategies[strategy_index]])
+
+    def flatten_all(self) -> typing.Dict[int, OrderStatus]:
+        """Close every open trade of every running strategy at market, see _flatten."""
+        return self._flatten(list(self.strategies.values()))
+
+    def _flatten(self, strategies: typing.List[Strategy]) \
+            -> typing.Dict[int, OrderStatus]:
+        """Sends the exit orders of all open trades in parallel and returns a dict with the trade entry_id as key and
+        the OrderStatus of its exit order as value (None if the exit order failed)."""
+        exits = []
+        for strategy in strategies:
+            for trade in strategy.trades:
+                if trade.status != 'open':
+                    continue
+                elif trade.entry_price is None:
+                    self.logger.warning(f'Trade {trade.entry_id} on {trade.asset.symbol} is not filled yet and was '
+                                        f'not flattened')
+                    continue
+                exits.append((strategy, trade))
 
-                self.prices[symbol] = {'bid': float(data['events'][0]['tickers'][0]['price']),
-                                       'ask': float(data['events'][0]['tickers'][0]['price'])}
+        results = dict()
+        orders = []
+        sized = []
+        for strategy, trade in exits:
+            # one position that can't be sized must not keep the others open
+            try:
+                order_side, quantity = strategy.exit_order_params(trade)
+            except ValueError as err:
+                self.logger.error(f'Failed to flatten trade {trade.entry_id} on {trade.asset.symbol}: {err}')
+                results[trade.entry_id] = None
+                continue
+            orders.append({'asset': trade.asset, 'side': order_side, 'order_type': 'MARKET', 'quantity': quantity,
+                           'priority': PRIORITY_STOP_LOSS})
+            sized.append((strategy, trade))
+
+        for (strategy, trade), order_status in zip(sized, self.place_orders(orders)):
+            results[trade.entry_id] = order_status
+
+            if order_status is not None:
+                strategy.close_trade(trade)
+                self.logger.info(f'Trade {trade.entry_id} on {trade.asset.symbol} flattened | Status: '
+                                 f'{order_status.status}')
             else:
-                self.prices[symbol]['bid'] = float(data['events'][0]['tickers'][0]['price'])
-                self.prices[symbol]['ask'] = float(data['events'][0]['tickers'][0]['price'])
+                self.logger.error(f'Failed to flatten trade {trade.entry_id} on {trade.asset.symbol}')
 
-            # PNL Calculation
-            # THIS CALCULATION DOES NOT TAKE INTO ACCOUNT FEES FOR TRANSACTIONS
+        return results
 
-            try:
-                for strategy_index, strategy in self.strategies.items():
-                    if strategy.asset.symbol == symbol:
-                        for trade in strategy.trades:
-                            if trade.status == 'open' and trade.entry_price is not None:
-                                if trade.side == 'long':
-                                    trade.pnl = (self.prices[symbol]['bid'] - float(trade.entry_price)) * \
-                                                (float(trade.quantity) / float(trade.entry_price))
-                                elif trade.side == 'short':
-                                    trade.pnl = (float(trade.entry_price) - self.prices[symbol]['ask']) * \
-                                                float(trade.quantity)
-
-            except RuntimeError:
-                logger.error('Error while looping through strategies dict to calculate the PNL')
-
-        # IF THERE IS A PROBLEM LATER ON, NOTED HERE THAT THIS CHANNEL GIVEs SELL SIDE INFO, NOT SURE HOW THIS WILL
-        # AFFECT FINAL PRODUCT
-        elif 'channel' in data and data['channel'] == 'market_trades':
-            symbol = data['events'][0]['trades'][0]['product_id']
-            # convert iso8601 datetime format to a unix timestamp in milliseconds
-            ts = int(dateutil.parser.isoparse(data['timestamp']).timestamp())
-
-            for key, strategy in self.strategies.items():
-                if strategy.asset.symbol == symbol:
-                    # In strategies.py this method results in "same_candle" or "new_candle" based on the feed
-                    res = strategy.parse_trade(float(data['events'][0]['trades'][0]['price']),
-                                               float(data['events'][0]['trades'][0]['size']), ts)
-                    # In strategies.py checks to see if our parameters have been met to enter a trade
-                    strategy.check_trade(res)
+    def _on_gap(self, gap_start: float):
+        """Backfills the candles every running strategy missed since gap_start, in the background so the feed keeps
+        going."""
+        for strategy in list(self.strategies.values()):
+            self._executor.submit(strategy.resync, gap_start)
 
-    def subscribe_channel(self, assets: typing.List[Asset], channel: str):
-        data = dict()
-        data['type'] = 'subscribe'
-        data['product_ids'] = []
-        for asset in assets:
-            data['product_ids'].append(asset.symbol)
-        data['channel'] = channel
-        data['api_key'] = self._public_key
-        data['timestamp'] = str(int(time.time()))
-        data['signature'] = self._create_signature(data['channel'], ','.join(data['product_ids']), data['timestamp'],
-                                                   dict())
+    def _on_ticker(self, symbol: str, price: float):
+        """Called by the feed once it updated self.prices, fills the paper orders and updates the PNL of the
+        strategies trading the symbol"""
+        quote = self.prices.snapshot(symbol)
 
-        try:
-            self._ws.send(json.dumps(data))
-        except Exception as err:
-            self.logger.error(f'Websocket error while subscribing to {len(assets) - 2} {channel} updates: {err}')
+        if self.paper is not None:
+            self.paper.on_quote(symbol, quote['bid'], quote['ask'])
 
-    def get_trade_size(self, side: str, asset: Asset, balance_pct: float):
+        try:
+            for strategy_index, strategy in self.strategies.items():
+                if strategy.asset.symbol == symbol:
+                    strategy.update_pnl(quote['bid'], quote['ask'])
+
+        except RuntimeError:
+            logger.error('Error while looping through strategies dict to calculate the PNL')
+
+    def _on_market_trades(self, trades: typing.List[typing.Tuple[str, float, float]],
+                          price_ranges: typing.Dict[str, typing.List[float]]):
+        """Every (symbol, price, size) trade of a market_trades message and the price range it covered by symbol."""
+        if self.paper is not None:
+            for symbol, price, size in trades:
+                self.paper.on_trade(symbol, price, size)
+
+        for symbol, (low, high) in price_ranges.items():
+            self._on_price_range(symbol, low, high)
+
+    def _on_price_range(self, symbol: str, low: float, high: float):
+        """Sends the exit orders of the trades whose take profit or stop loss is between low and high, in the
+        background so the feed is not held up by the REST calls."""
+        if symbol not in self.assets:
+            return
+        for trigger in self.triggers.check(self.assets[symbol], low, high):
+            self._exit_executor.submit(trigger.strategy.on_trigger, trigger.trade, trigger.kind)
+
+    def _on_market_trade(self, symbol: str, price: float, size: float, ts: int):
+        for key, strategy in self.strategies.items():
+            if strategy.asset.symbol == symbol:
+                # In strategies.py this method results in "same_candle" or "new_candle" based on the feed
+                res = strategy.parse_trade(price, size, ts)
+                # In strategies.py checks to see if our parameters have been met to enter a trade
+                strategy.check_trade(res)
+
+    def get_trade_size(self, side: str, asset: Asset, balance_pct: float) -> typing.Optional[float]:
         # will need to add conditional if limit orders are to be utilized
         """Market/BUY orders trade_size must be calculated in quote currency. Market/SELL orders trade_size calculated
         in base currency. No limit orders yet"""
@@ -332,7 +466,7 @@ class CoinbaseClient:
                 # make sure you own enough of the asset to sell
                 if asset.symbol.split('-')[0] in balance:
                     balance = balance[asset.symbol.split('-')[0]].wallet_balance
-                    trade_size = round(balance * (balance_pct / 100), asset.base_increment)
+                    trade_size = asset.ticks_to_size(asset.size_to_ticks(balance * (balance_pct / 100)))
                     logger.info(f'Current balance of {asset.symbol.split("-")[0]}: {balance} | trade size: '
                                 f'{trade_size}')
                 else:
@@ -340,4 +474,4 @@ class CoinbaseClient:
         else:
             return None
 
-        return str(trade_size)
+        return float(trade_size)
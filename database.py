@@ -32,3 +32,31 @@ class WorkspaceData:
         self.cursor.execute(f'SELECT * FROM {table}')
         data = self.cursor.fetchall()
         return data
+
+
+class CandleData:
+    """Local candle history, filled by the backfill job (backfill.py). Kept in its own file so a large history doesn't
+    slow down the workspace database."""
+    def __init__(self, path: str = 'candles.db'):
+        # the backfill writes from one thread but the strategies may read from others
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.cursor = self.conn.cursor()
+
+        self.cursor.execute('CREATE TABLE IF NOT EXISTS candles (symbol TEXT, granularity TEXT, timestamp INTEGER, '
+                            'open REAL, high REAL, low REAL, close REAL, volume REAL, '
+                            'PRIMARY KEY (symbol, granularity, timestamp))')
+
+        self.conn.commit()
+
+    def save_candles(self, data: typing.List[typing.Tuple]):
+        """Bulk insert of (symbol, granularity, timestamp, open, high, low, close, volume) tuples, candles that are
+        already stored are replaced."""
+        self.cursor.executemany('INSERT OR REPLACE INTO candles (symbol, granularity, timestamp, open, high, low, '
+                                'close, volume) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', data)
+        self.conn.commit()
+
+    def get_candles(self, symbol: str, granularity: str, start: int, end: int) -> typing.List[sqlite3.Row]:
+        self.cursor.execute('SELECT * FROM candles WHERE symbol = ? AND granularity = ? AND timestamp >= ? AND '
+                            'timestamp < ? ORDER BY timestamp', (symbol, granularity, start, end))
+        return self.cursor.fetchall()
@@ -0,0 +1,180 @@
+import indicators
+import numpy as np
+import threading
+import typing
+if typing.TYPE_CHECKING:
+    from strategies import Strategy
+
+IndicatorKey = typing.Tuple[str, str, str, typing.Tuple]
+# start of the candle in progress, number of candles, close and volume of the last closed candle
+Stamp = typing.Tuple[int, int, float, float]
+
+
+def candle_stamp(candles: typing.List) -> Stamp:
+    """What a cached value depends on. The last closed candle is part of it because a late trade or a resync can
+    still change it after the next candle opened, the length because strategies on the same key can hold histories
+    of different lengths (see IndicatorService)."""
+    previous = candles[-2] if len(candles) > 1 else candles[-1]
+    return candles[-1].timestamp, len(candles), previous.close, previous.volume
+
+
+def _macd(series: typing.Dict[str, np.ndarray], fast: int, slow: int, signal: int) -> typing.Dict[str, np.ndarray]:
+    line, signal_line = indicators.macd(series['close'], fast, slow, signal)
+    return {'line': line, 'signal': signal_line, 'hist': line - signal_line}
+
+
+def _bollinger(series: typing.Dict[str, np.ndarray], length: int, k: float) -> typing.Dict[str, np.ndarray]:
+    middle, upper, lower = indicators.bollinger(series['close'], length, k)
+    return {'middle': middle, 'upper': upper, 'lower': lower}
+
+
+def _donchian(series: typing.Dict[str, np.ndarray], length: int) -> typing.Dict[str, np.ndarray]:
+    upper, lower, middle = indicators.donchian(series['high'], series['low'], length)
+    return {'upper': upper, 'lower': lower, 'middle': middle}
+
+
+def _stoch_rsi(series: typing.Dict[str, np.ndarray], rsi_length: int, stoch_length: int, k: int,
+               d: int) -> typing.Dict[str, np.ndarray]:
+    k_line, d_line = indicators.stoch_rsi(series['close'], rsi_length, stoch_length, k, d)
+    return {'k': k_line, 'd': d_line}
+
+
+# indicator name -> function of the candle arrays and the params, returning the outputs by name
+INDICATORS: typing.Dict[str, typing.Callable[..., typing.Dict[str, np.ndarray]]] = {
+    'rsi': lambda series, length: {'rsi': indicators.rsi(series['close'], length)},
+    'macd': _macd,
+    'bollinger': _bollinger,
+    'atr': lambda series, length: {'atr': indicators.atr(series['high'], series['low'], series['close'], length)},
+    'vwap': lambda series, length: {'vwap': indicators.vwap(series['high'], series['low'], series['close'],
+                                                            series['volume'], length)},
+    'donchian': _donchian,
+    'stoch_rsi': _stoch_rsi,
+}
+
+
+class IndicatorService:
+    """Indicator values shared by all the strategies of a client. A value is identified by (symbol, timeframe,
+    indicator, params), so two strategies asking for rsi(14) on BTC-USD 1h get the same arrays, computed once per
+    candle: the cache entry is stamped with candle_stamp() and only recomputed after the next candle opened or the
+    last closed candle changed (or after the history was resynced, see invalidate).
+
+    The values are computed from the candles of the strategy that asked first. Strategies on the same key normally
+    hold the same history (same download, same feed); when their lengths differ the stamps don't match and each one
+    gets values computed from its own candles instead of the other's.
+
+    Strategies subscribe to the keys they use and unsubscribe when they stop, a key nobody references anymore is
+    evicted with its values."""
+    def __init__(self):
+        self._refcounts: typing.Dict[IndicatorKey, int] = dict()
+        # key -> (candle_stamp of the candles it was computed from, outputs)
+        self._cache: typing.Dict[IndicatorKey, typing.Tuple[Stamp, typing.Dict[str, np.ndarray]]] = dict()
+        self._lock = threading.Lock()
+
+    def subscribe(self, symbol: str, timeframe: str, indicator: str, *params) -> IndicatorKey:
+        if indicator not in INDICATORS:
+            raise ValueError(f'Unknown indicator {indicator!r}, available: {", ".join(INDICATORS)}')
+
+        key = (symbol, timeframe, indicator, tuple(params))
+        with self._lock:
+            self._refcounts[key] = self._refcounts.get(key, 0) + 1
+        return key
+
+    def unsubscribe(self, key: IndicatorKey):
+        with self._lock:
+            if key not in self._refcounts:
+                return
+            self._refcounts[key] -= 1
+            if self._refcounts[key] <= 0:
+                del self._refcounts[key]
+                self._cache.pop(key, None)
+
+    def invalidate(self, symbol: str, timeframe: str):
+        """Drops the cached values of a series whose past candles changed."""
+        with self._lock:
+            for key in [key for key in self._cache if key[0] == symbol and key[1] == timeframe]:
+                del self._cache[key]
+
+    def cached(self) -> typing.List[typing.Tuple[IndicatorKey, Stamp, typing.Dict[str, np.ndarray]]]:
+        """(key, stamp, outputs) of every value in the cache, for the snapshots."""
+        with self._lock:
+            return [(key, stamp, outputs) for key, (stamp, outputs) in self._cache.items()]
+
+    def restore(self, key: IndicatorKey, stamp: Stamp, outputs: typing.Dict[str, np.ndarray]):
+        """Puts back a value saved in a snapshot, only if a strategy subscribed to it again."""
+        with self._lock:
+            if key in self._refcounts and key not in self._cache:
+                self._cache[key] = (stamp, outputs)
+
+    def get(self, key: IndicatorKey, strategy: "Strategy") -> typing.Dict[str, np.ndarray]:
+        """Outputs of the indicator over the candles of the strategy's series, one array per output ending on the candle
+        in progress, so the last closed candle is at index -2."""
+        with strategy._candle_lock:
+            if len(strategy.candles) == 0:
+                return {}
+            stamp = candle_stamp(strategy.candles)
+
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+            series = strategy.candle_series()
+
+        outputs = INDICATORS[key[2]](series, *key[3])
+
+        with self._lock:
+            # an unsubscribed key is not cached again
+            if key in self._refcounts:
+                self._cache[key] = (stamp, outputs)
+        return outputs
+
+    def get_many(self, requests: typing.List[typing.Tuple[IndicatorKey, "Strategy"]]) \
+            -> typing.List[typing.Dict[str, np.ndarray]]:
+        """get() for many (key, strategy) at once, used by the batched signals (see evaluate_signals). The values that
+        are not cached are computed together, one stacked array per (indicator, params) with a row per series, and
+        cached like get() does, so the batched and the per strategy paths read the same values."""
+        results: typing.Dict[IndicatorKey, typing.Dict[str, np.ndarray]] = dict()
+        # (indicator, params) -> key -> (stamp, series)
+        missing: typing.Dict[typing.Tuple[str, typing.Tuple], typing.Dict[IndicatorKey, typing.Tuple]] = dict()
+
+        for key, strategy in requests:
+            if key in results or key in missing.get((key[2], key[3]), {}):
+                continue
+            with strategy._candle_lock:
+                if len(strategy.candles) == 0:
+                    results[key] = {}
+                    continue
+                stamp = candle_stamp(strategy.candles)
+
+                cached = self._cache.get(key)
+                if cached is not None and cached[0] == stamp:
+                    results[key] = cached[1]
+                    continue
+                series = strategy.candle_series()
+            missing.setdefault((key[2], key[3]), dict())[key] = (stamp, series)
+
+        for (indicator, params), entries in missing.items():
+            keys = list(entries.keys())
+            if len(keys) == 1:
+                computed = [INDICATORS[indicator](entries[keys[0]][1], *params)]
+            else:
+                # right aligned, the rows of the shorter series start with nan and give the same values
+                stacked = {field: indicators.stack_series([entries[key][1][field] for key in keys])
+                           for field in entries[keys[0]][1]}
+                outputs = INDICATORS[indicator](stacked, *params)
+                computed = [{name: values[row, values.shape[1] - len(entries[key][1]['close']):]
+                             for name, values in outputs.items()} for row, key in enumerate(keys)]
+
+            with self._lock:
+                for key, outputs in zip(keys, computed):
+                    if key in self._refcounts:
+                        self._cache[key] = (entries[key][0], outputs)
+                    results[key] = outputs
+
+        return [results[key] for key, _ in requests]
+
+    def latest(self, key: IndicatorKey, strategy: "Strategy") -> typing.Dict[str, float]:
+        """Outputs of the indicator on the last closed candle."""
+        outputs = self.get(key, strategy)
+        return {name: float(values[-2]) if len(values) > 1 else np.nan for name, values in outputs.items()}
+
+    def __len__(self) -> int:
+        return len(self._refcounts)
@@ -0,0 +1,190 @@
+from models import *
+import numpy as np
+import typing
+
+# All the functions below work along the last axis, so the same code computes an indicator for a single series of
+# shape (n_candles,) or for many series stacked in a 2-D array of shape (n_series, n_candles). Stacked series are
+# left padded with NaN (see stack_series), NaN values before the first real value are ignored the same way pandas
+# ignores them.
+
+
+def candle_arrays(candles: typing.List[Candle]) -> typing.Dict[str, np.ndarray]:
+    """Turns a list of Candle objects into one numpy array per field."""
+    return {'timestamp': np.array([candle.timestamp for candle in candles], dtype=np.int64),
+            'open': np.array([candle.open for candle in candles], dtype=np.float64),
+            'high': np.array([candle.high for candle in candles], dtype=np.float64),
+            'low': np.array([candle.low for candle in candles], dtype=np.float64),
+            'close': np.array([candle.close for candle in candles], dtype=np.float64),
+            'volume': np.array([candle.volume for candle in candles], dtype=np.float64)}
+
+
+def stack_series(series_list: typing.List[np.ndarray]) -> np.ndarray:
+    """Stacks 1-D series of different lengths into a 2-D array, right aligned so the last candles line up."""
+    length = max(len(series) for series in series_list)
+    stacked = np.full((len(series_list), length), np.nan)
+    for row, series in enumerate(series_list):
+        if len(series) > 0:
+            stacked[row, length - len(series):] = series
+    return stacked
+
+
+def ewm_mean(values: np.ndarray, alpha: float, min_periods: int = 0) -> np.ndarray:
+    """Exponentially weighted mean, same result as pandas .ewm(alpha=alpha, adjust=True).mean()"""
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(values.shape, np.nan)
+
+    numerator = np.zeros(values.shape[:-1])
+    denominator = np.zeros(values.shape[:-1])
+    count = np.zeros(values.shape[:-1])
+    decay = 1 - alpha
+
+    # the loop runs over time only, every step is vectorized over all the stacked series
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i in range(values.shape[-1]):
+            x = values[..., i]
+            valid = ~np.isnan(x)
+            numerator = numerator * decay + np.where(valid, x, 0)
+            denominator = denominator * decay + valid
+            count += valid
+            out[..., i] = np.where(count >= max(min_periods, 1), numerator / denominator, np.nan)
+
+    return out
+
+
+def ema(values: np.ndarray, span: int) -> np.ndarray:
+    return ewm_mean(values, 2 / (span + 1))
+
+
+def sma(values: np.ndarray, length: int) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(values.shape, np.nan)
+    if values.shape[-1] < length:
+        return out
+
+    cumsum = np.cumsum(np.nan_to_num(values), axis=-1)
+    cumsum = np.concatenate([np.zeros(values.shape[:-1] + (1,)), cumsum], axis=-1)
+    windows = cumsum[..., length:] - cumsum[..., :-length]
+    # a window that still contains padding is not a full window
+    nan_count = np.cumsum(np.isnan(values), axis=-1)
+    nan_count = np.concatenate([np.zeros(values.shape[:-1] + (1,)), nan_count], axis=-1)
+    full = (nan_count[..., length:] - nan_count[..., :-length]) == 0
+
+    out[..., length - 1:] = np.where(full, windows / length, np.nan)
+    return out
+
+
+def diff(values: np.ndarray) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(values.shape, np.nan)
+    out[..., 1:] = values[..., 1:] - values[..., :-1]
+    return out
+
+
+def shift(values: np.ndarray, periods: int = 1) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(values.shape, np.nan)
+    if periods == 0:
+        return values.copy()
+    out[..., periods:] = values[..., :-periods]
+    return out
+
+
+def rsi(closes: np.ndarray, length: int) -> np.ndarray:
+    """Same calculation as the pandas version in TechnicalStrategy._rsi, rounded to 2 decimals."""
+    delta = diff(closes)
+    # for up we set the losses from one candle to the next to 0, for down the gains (NaN stays NaN)
+    up = np.where(delta < 0, 0, delta)
+    down = np.abs(np.where(delta > 0, 0, delta))
+
+    avg_gain = ewm_mean(up, 1 / length, min_periods=length)
+    avg_loss = ewm_mean(down, 1 / length, min_periods=length)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = avg_gain / avg_loss
+        return np.round(100 - (100 / (1 + rs)), 2)
+
+
+def macd(closes: np.ndarray, fast: int, slow: int, signal: int) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """Returns the macd line and the signal line."""
+    macd_line = ema(closes, fast) - ema(closes, slow)
+    macd_signal = ema(macd_line, signal)
+    return macd_line, macd_signal
+
+
+def cross_up(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """True on the candle where a moves from below or equal to b to above b."""
+    a, b = np.broadcast_arrays(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64))
+    return (a > b) & (shift(a) <= shift(b))
+
+
+def cross_down(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """True on the candle where a moves from above or equal to b to below b."""
+    a, b = np.broadcast_arrays(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64))
+    return (a < b) & (shift(a) >= shift(b))
+
+
+def _rolling(values: np.ndarray, length: int, reducer: typing.Callable) -> np.ndarray:
+    """Applies reducer(windows, axis=-1) to every full window of length candles, NaN until the first full window."""
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(values.shape, np.nan)
+    if values.shape[-1] < length:
+        return out
+    windows = np.lib.stride_tricks.sliding_window_view(values, length, axis=-1)
+    # a window that still contains padding is NaN, the reducers below propagate it
+    out[..., length - 1:] = reducer(windows, axis=-1)
+    return out
+
+
+def rolling_max(values: np.ndarray, length: int) -> np.ndarray:
+    return _rolling(values, length, np.max)
+
+
+def rolling_min(values: np.ndarray, length: int) -> np.ndarray:
+    return _rolling(values, length, np.min)
+
+
+def rolling_std(values: np.ndarray, length: int) -> np.ndarray:
+    """Population standard deviation (ddof=0) like most charting platforms use for the Bollinger bands."""
+    return _rolling(values, length, np.std)
+
+
+def bollinger(closes: np.ndarray, length: int = 20, k: float = 2) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the middle, upper and lower bands."""
+    middle = sma(closes, length)
+    width = k * rolling_std(closes, length)
+    return middle, middle + width, middle - width
+
+
+def atr(highs: np.ndarray, lows: np.ndarray, closes: np.ndarray, length: int = 14) -> np.ndarray:
+    """Average true range with Wilder's smoothing. The first candle has no previous close, its range is high - low."""
+    previous_close = shift(closes)
+    with np.errstate(invalid='ignore'):
+        true_range = np.fmax(np.asarray(highs, dtype=np.float64) - lows,
+                             np.fmax(np.abs(highs - previous_close), np.abs(lows - previous_close)))
+    return ewm_mean(true_range, 1 / length, min_periods=length)
+
+
+def vwap(highs: np.ndarray, lows: np.ndarray, closes: np.ndarray, volumes: np.ndarray, length: int) -> np.ndarray:
+    """Volume weighted average of the typical price over the last length candles, NaN if nothing traded."""
+    typical_price = (np.asarray(highs, dtype=np.float64) + lows + closes) / 3
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return sma(typical_price * volumes, length) / sma(volumes, length)
+
+
+def donchian(highs: np.ndarray, lows: np.ndarray, length: int = 20) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the upper, lower and middle lines of the channel."""
+    upper = rolling_max(highs, length)
+    lower = rolling_min(lows, length)
+    return upper, lower, (upper + lower) / 2
+
+
+def stoch_rsi(closes: np.ndarray, rsi_length: int = 14, stoch_length: int = 14, k: int = 3,
+              d: int = 3) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """Stochastic oscillator (0-100) applied to the RSI, returns the smoothed %K and %D lines."""
+    rsi_values = rsi(closes, rsi_length)
+    lowest = rolling_min(rsi_values, stoch_length)
+    highest = rolling_max(rsi_values, stoch_length)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stoch = 100 * (rsi_values - lowest) / (highest - lowest)
+    k_line = sma(stoch, k)
+    return k_line, sma(k_line, d)
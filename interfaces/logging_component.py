@@ -1,4 +1,6 @@
 import logging
+import logging.handlers
+import multiprocessing
 
 
 class Logging(logging.Logger):
@@ -17,6 +19,12 @@ class Logging(logging.Logger):
         # were set to different levels?
         self.stream_handler.setLevel(logging.INFO)
 
+        # the processes of the sharded mode (sharding.py) import this module too, opening info.log there would
+        # truncate the log of the main process. They send their records to it with log_to_queue instead. The process
+        # name is already set while a spawned child imports the modules, parent_process() is not
+        if multiprocessing.current_process().name != 'MainProcess':
+            return
+
         # because I do not want to use a visual interface I want to be able to delete old logs
         self.file_handler = logging.FileHandler('info.log', mode='w')
         # I assume formatter needs to be passed so the output to the file is the same that gets sent to the console
@@ -41,4 +49,21 @@ def get_logger(name=None):
         logging._releaseLock()
 
 
+def log_to_queue(queue):
+    """Called first thing in a child process, sends all its logs to the listener of the main process (see
+    start_queue_listener) so there is a single writer of info.log and the console."""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(queue))
+    root.setLevel(logging.DEBUG)
+
+
+def start_queue_listener(queue) -> logging.handlers.QueueListener:
+    """Writes the records child processes put on the queue with the handlers of this process, stop() it on shutdown."""
+    listener = logging.handlers.QueueListener(queue, *logging.getLogger().handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
 logger = get_logger(__name__)
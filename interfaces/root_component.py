@@ -1,20 +1,30 @@
 from coinbase import CoinbaseClient
 import json
 from interfaces.logging_component import logger
+from snapshot import StateSnapshot, restore_prices
 from interfaces.strategy_component import StrategyEditor
+from strategies import STRATEGY_TYPES
 from threading import Timer
 from interfaces.watchlist_component import Watchlist
 
 
 class Root:
+    SNAPSHOT_INTERVAL = 60
+
     def __init__(self, coinbase: CoinbaseClient):
         self.coinbase = coinbase
 
         self.logger = logger
         self.logger.info('Root component initialized')
 
+        # runtime state saved every SNAPSHOT_INTERVAL seconds and on shutdown, see snapshot.py
+        self.snapshots = StateSnapshot('snapshot.bin')
+        snapshot = self.snapshots.load()
+        if snapshot is not None:
+            restore_prices(self.coinbase, snapshot)
+
         self.watch_list = Watchlist(self.coinbase.assets)
-        self.strategy_editor = StrategyEditor(self.coinbase)
+        self.strategy_editor = StrategyEditor(self.coinbase, snapshot)
 
         # if you want to add/delete strategies to what the strategy_component.trade_strategies dict already contains
         # then do it here:
@@ -22,6 +32,8 @@ class Root:
         # self.strategy_editor.add_strategy('Technical', 'SOL-USD', 'ONE_MINUTE', '1', '1', '1', '14', '12', '26',
         # '9')
         # self.strategy_editor.add_strategy('Breakout', 'BTC-USD', 'ONE_MINUTE', '1', '1', '1', '1')
+        # self.strategy_editor.add_strategy('Rule', 'BTC-USD', 'FIVE_MINUTE', '1', '1', '1',
+        # 'rsi(14) < 30 and macd(12, 26, 9).cross_up', 'rsi(14) > 70 and macd(12, 26, 9).cross_down')
         # for i in range(len(self.strategy_editor.trade_strategies)):
         #     self.strategy_editor.delete_strategy(0)
 
@@ -29,11 +41,32 @@ class Root:
         # self.strategy_editor.switch_strategy(0)
         # self.strategy_editor.switch_strategy(1)
 
+        # if you want to limit the risk taken by all strategies together set the limits here (None means no limit):
+        # self.coinbase.risk.limits.max_asset_notional = 100
+        # self.coinbase.risk.limits.max_portfolio_notional = 250
+        # self.coinbase.risk.limits.max_open_trades = 5
+        # self.coinbase.risk.limits.max_daily_loss = 20
+
         # if you want to add/delete symbols to what the watchlist already contains do it here:
         # self.watch_list.remove_symbol('BTC-USD')
         # self.watch_list.add_symbol('SOL-USD')
 
         self._update_ui()
+        # the first one waits for an interval, the strategies to restore from the last snapshot are activated by then
+        self._schedule_snapshot()
+
+    def _schedule_snapshot(self):
+        t = Timer(self.SNAPSHOT_INTERVAL, lambda: self._save_snapshot())
+        t.daemon = True
+        t.start()
+
+    def _save_snapshot(self):
+        try:
+            self.snapshots.save(self.coinbase, self.strategy_editor.trade_strategies)
+        except Exception as err:
+            logger.error(f'Error while saving the snapshot: {err}')
+
+        self._schedule_snapshot()
 
     def _update_ui(self):
 
@@ -88,22 +121,13 @@ class Root:
             take_profit = strategy['take_profit']
             stop_loss = strategy['stop_loss']
 
-            extra_params = dict()
-
-            if strategy_type == 'Breakout':
-                extra_params['min_volume'] = strategy['min_volume']
-                strategies.append((strategy_type, asset, timeframe, balance_pct, take_profit, stop_loss,
-                                   json.dumps(extra_params),))
-
-            elif strategy_type == 'Technical':
-                extra_params['rsi_length'] = strategy['rsi_length']
-                extra_params['ema_fast'] = strategy['ema_fast']
-                extra_params['ema_slow'] = strategy['ema_slow']
-                extra_params['ema_signal'] = strategy['ema_signal']
-
-                strategies.append((strategy_type, asset, timeframe, balance_pct, take_profit, stop_loss,
-                                   json.dumps(extra_params),))
+            # the extra parameters of every strategy type are stored as json, their names come from the registry
+            extra_params = {name: strategy[name] for name, _ in STRATEGY_TYPES[strategy_type].extra_params}
+            strategies.append((strategy_type, asset, timeframe, balance_pct, take_profit, stop_loss,
+                               json.dumps(extra_params),))
 
         self.strategy_editor.db.save('strategies', strategies)
 
+        self.snapshots.save(self.coinbase, self.strategy_editor.trade_strategies)
+
         logger.info('Workspace saved')
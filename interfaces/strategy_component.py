@@ -2,19 +2,23 @@ from database import *
 from coinbase import CoinbaseClient
 import json
 from interfaces.root_component import logger
-from strategies import TechnicalStrategy, BreakoutStrategy
+from signal_language import RuleSyntaxError
+from snapshot import Snapshot, restore_indicators, restore_strategy
+from strategies import STRATEGY_TYPES, create_strategy
 # from trades_component import TradesWatch
 
 
 class StrategyEditor:
-    def __init__(self, coinbase: CoinbaseClient):
+    def __init__(self, coinbase: CoinbaseClient, snapshot: Snapshot = None):
 
         self.coinbase = coinbase
+        # state saved before the last shutdown, strategies activated with the same parameters resume from it
+        self.snapshot = snapshot
         self.logger = logger
 
         self.db = WorkspaceData()
 
-        self._all_assets = [key for key in self.coinbase.get_assets().keys()]
+        self._all_assets = [key for key in self.coinbase.assets.keys()]
         self._all_timeframes = ['ONE_MINUTE', 'FIVE_MINUTE', 'FIFTEEN_MINUTE', 'THIRTY_MINUTE', 'ONE_HOUR', 'TWO_HOUR',
                                 'SIX_HOUR', 'ONE_DAY']
 
@@ -30,13 +34,14 @@ class StrategyEditor:
     def add_strategy(self, strategy_type: str, asset: str, time_frame: str, balance_pct: str, take_profit: str,
                      stop_loss: str, *args):
         """Add a strategy to the self.trade_strategies dictionary, called in the root_component"""
-        if strategy_type == 'Breakout' and len(args) != 1:
-            self.logger.warn(f'You did not input the correct number of additional parameters for {strategy_type} '
-                             f'strategy.')
+        if strategy_type not in STRATEGY_TYPES:
+            self.logger.warn(f'{strategy_type} is not a valid strategy type, choose from {list(STRATEGY_TYPES)}.')
             return
-        elif strategy_type == 'Technical' and len(args) != 4:
+
+        extra_params = STRATEGY_TYPES[strategy_type].extra_params
+        if len(args) != len(extra_params):
             self.logger.warn(f'You did not input the correct number of additional parameters for {strategy_type} '
-                             f'strategy.')
+                             f'strategy, expected {[name for name, _ in extra_params]}.')
             return
 
         # create new entry into self.trade_strategies
@@ -47,15 +52,7 @@ class StrategyEditor:
                                                  'take_profit': take_profit, 'stop_loss': stop_loss}
 
         # add the additional parameters to self.trade strategies, based on type of strategy desired
-        if self.trade_strategies[strategy_index]['strategy_type'] == 'Breakout':
-            self.trade_strategies[strategy_index].update({'min_volume': args[0]})
-
-        elif self.trade_strategies[strategy_index]['strategy_type'] == 'Technical':
-            self.trade_strategies[strategy_index].update({
-                'rsi_length': args[0],
-                'ema_fast': args[1],
-                'ema_slow': args[2],
-                'ema_signal': args[3]})
+        self.trade_strategies[strategy_index].update({name: value for (name, _), value in zip(extra_params, args)})
 
         self._strategy_index += 1
 
@@ -66,41 +63,51 @@ class StrategyEditor:
 
         asset = self.coinbase.assets[symbol]
         timeframe = strat_selected['timeframe']
-        balance_pct = float(strat_selected['balance_pct'])
-        take_profit = float(strat_selected['take_profit'])
-        stop_loss = float(strat_selected['stop_loss'])
-
-        if strat_selected['strategy_type'] == 'Technical':
-            rsi_length = int(strat_selected['rsi_length'])
-            ema_fast = int(strat_selected['ema_fast'])
-            ema_slow = int(strat_selected['ema_slow'])
-            ema_signal = int(strat_selected['ema_signal'])
-            new_strategy = TechnicalStrategy(self.coinbase, asset, timeframe, balance_pct, take_profit, stop_loss,
-                                             rsi_length, ema_fast, ema_slow, ema_signal)
-
-        elif strat_selected['strategy_type'] == 'Breakout':
-            min_volume = int(strat_selected['min_volume'])
-            new_strategy = BreakoutStrategy(self.coinbase, asset, timeframe, balance_pct, take_profit, stop_loss,
-                                            min_volume)
-        else:
+
+        if strategy_index in self.coinbase.strategies:
+            # already running: deactivate it
+            strategy = self.coinbase.strategies.pop(strategy_index)
+            self.coinbase.candle_clock.remove(strategy)
+            strategy.stop()
+            self.logger.info(f'{strat_selected["strategy_type"]} strategy DEACTIVATED on {symbol} {timeframe}')
+            return
+
+        if strat_selected['strategy_type'] not in STRATEGY_TYPES:
             self.logger.warn(f'{strat_selected["strategy_type"]} is not a valid strategy type.')
+            return
+
+        try:
+            new_strategy = create_strategy(self.coinbase, strat_selected)
+        except RuleSyntaxError as err:
+            self.logger.warn(f'Invalid rule for strategy {strategy_index}: {err}')
+            return
 
         self.logger.info(f'{strat_selected["strategy_type"]} strategy ACTIVATED on {symbol} {timeframe}')
 
-        new_strategy.candles = self.coinbase.get_historical_candles(asset, timeframe)
-        new_strategy.candles.reverse()
+        state = self.snapshot.strategy_state(strategy_index, strat_selected) if self.snapshot is not None else None
+        if state is not None and restore_strategy(new_strategy, self.snapshot, state):
+            restore_indicators(self.coinbase, self.snapshot)
+        else:
+            new_strategy.candles = self.coinbase.get_historical_candles(asset, timeframe)
+            new_strategy.candles.reverse()
 
         if len(new_strategy.candles) == 0:
             self.logger.warn(f'No historical data retrieved for {asset.symbol}')
+            new_strategy.stop()
             return
 
         # add your newly created strategy to the strategies dict created in coinbase.py
         self.coinbase.strategies[strategy_index] = new_strategy
+        self.coinbase.candle_clock.add(new_strategy)
+        if self.snapshot is not None:
+            self.snapshot.release(strategy_index)
 
     def delete_strategy(self, strategy_index: int):
         """Build new self.trade_strategies dict w/o strategy indicated by strategy_index."""
         # delete indicated entry in old self.trade_strategies dict
         del self.trade_strategies[strategy_index]
+        if self.snapshot is not None:
+            self.snapshot.remove(strategy_index)
 
         # build new self.trade_strategies dict
         old_values = list(self.trade_strategies.values())
@@ -114,15 +121,11 @@ class StrategyEditor:
         data = self.db.get('strategies')
 
         for row in data:
-            if row['strategy_type'] == 'Breakout':
-                extra_params = json.loads(row['extra_params'])
-                self.add_strategy(row['strategy_type'], row['asset'], row['timeframe'], row['balance_pct'],
-                                   row['take_profit'], row['stop_loss'], extra_params['min_volume'])
-
-            elif row['strategy_type'] == 'Technical':
-                extra_params = json.loads(row['extra_params'])
-                self.add_strategy(row['strategy_type'], row['asset'], row['timeframe'], row['balance_pct'],
-                                   row['take_profit'], row['stop_loss'], extra_params['rsi_length'],
-                                   extra_params['ema_fast'], extra_params['ema_slow'], extra_params['ema_signal'])
-
-
+            if row['strategy_type'] not in STRATEGY_TYPES:
+                self.logger.warn(f'Saved strategy type {row["strategy_type"]} is not registered, skipping it.')
+                continue
+
+            extra_params = json.loads(row['extra_params'])
+            self.add_strategy(row['strategy_type'], row['asset'], row['timeframe'], row['balance_pct'],
+                              row['take_profit'], row['stop_loss'],
+                              *[extra_params[name] for name, _ in STRATEGY_TYPES[row['strategy_type']].extra_params])
@@ -1,30 +1,53 @@
 import atexit
 from coinbase import CoinbaseClient
+from database import WorkspaceData
 from dotenv import load_dotenv
 from interfaces.root_component import Root
+from paper_trading import PaperExecution
+import json
 import os
-import signal
+from sharding import ShardedDeployment
 
 load_dotenv()
 
 if __name__ == '__main__':
-    coinbase = CoinbaseClient(os.getenv('API_Key'), os.getenv('API_Secret'))
-
-    # create limit orders here, see coinbase.py for instructions in the place_order method
-
-    root = Root(coinbase)
-    atexit.register(root.save_workspace)
-    # signal.signal(signal.SIGTERM, root.save_workspace)
-    # signal.signal(signal.SIGKILL, root.save_workspace)
-
-
-
-
-
-
-
-
-
-
-
-
+    if os.getenv('SHARDS') and os.getenv('PAPER'):
+        # the execution process of the sharded mode sends every order to Coinbase, there is no simulator there
+        raise SystemExit('PAPER can not be used with SHARDS: the sharded mode only trades on the live account. Unset '
+                         'one of them in your .env file')
+
+    if os.getenv('SHARDS'):
+        # multi-process mode: runs every saved strategy, sharded by symbol across SHARDS worker processes
+        strategy_configs = dict()
+        for strategy_index, row in enumerate(WorkspaceData().get('strategies')):
+            config = dict(row)
+            config.update(json.loads(config.pop('extra_params')))
+            strategy_configs[strategy_index] = config
+
+        deployment = ShardedDeployment(os.getenv('API_Key'), os.getenv('API_Secret'), strategy_configs,
+                                       int(os.getenv('SHARDS')))
+        deployment.start()
+        atexit.register(deployment.stop)
+        deployment.join()
+
+    else:
+        # paper trading mode: orders are filled against the live feed with a simulated balance of PAPER USD
+        paper = PaperExecution({'USD': float(os.getenv('PAPER'))}) if os.getenv('PAPER') else None
+        coinbase = CoinbaseClient(os.getenv('API_Key'), os.getenv('API_Secret'), paper=paper)
+
+        # other accounts share the websocket feed, product catalog and prices of the first client, only their orders,
+        # balances and strategies are their own (see market_data.py):
+        # other_account = CoinbaseClient(os.getenv('API_Key_2'), os.getenv('API_Secret_2'), feed=coinbase.feed)
+        # atexit.register(other_account.close)
+
+        # create limit orders here, see coinbase.py for instructions in the place_order method
+
+        # backfill the candle history of many products into candles.db here, see backfill.py. Running it again resumes
+        # where an interrupted run stopped:
+        # HistoryBackfill(coinbase, ['BTC-USD', 'ETH-USD'], start=int(time.time()) - 90 * 86400).run()
+
+        root = Root(coinbase)
+        atexit.register(root.save_workspace)
+        atexit.register(coinbase.close)
+        # signal.signal(signal.SIGTERM, root.save_workspace)
+        # signal.signal(signal.SIGKILL, root.save_workspace)
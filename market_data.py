@@ -0,0 +1,234 @@
+from models import *
+import dateutil.parser
+from interfaces.logging_component import logger
+import json
+from price_table import PriceTable
+import random
+import threading
+from trade_tape import TradeTape
+import time
+import typing
+import websocket
+if typing.TYPE_CHECKING:
+    from coinbase import CoinbaseClient
+
+
+class MarketDataFeed:
+    """The market data side of the bot: one websocket connection, the product catalog, the price table and the trade
+    tape, shared by every CoinbaseClient registered on it. Each message is decoded once and handed to the clients,
+    which only hold what belongs to their account (REST session, balances, strategies, trades), so running several API
+    keys or portfolios doesn't multiply the feed bandwidth, the decoding or the startup requests.
+
+    The catalog is downloaded and the subscriptions are signed with the client the feed is created with, see
+    CoinbaseClient.__init__:
+
+        coinbase = CoinbaseClient(key, secret)
+        other_account = CoinbaseClient(other_key, other_secret, feed=coinbase.feed)
+    """
+    def __init__(self, client: "CoinbaseClient"):
+        self._client = client
+        self._ws_url = 'wss://advanced-trade-ws.coinbase.com'
+
+        # dict that contains the 'product-id' of each asset as a key and Asset object further defined in models.py
+        self.assets: typing.Dict[str, Asset] = client.get_assets()
+        # table with the contract name ('BTC-USDT') as a key holding the best bid, ask and last price, filled by the
+        # websocket and the get_bid_ask method of the clients
+        self.prices = PriceTable(list(self.assets.keys()))
+        # every trade of the market_trades channel is archived here, see trade_tape.py for the query methods
+        self.tape = TradeTape('tape')
+
+        # clients the decoded messages are handed to, copied on write so the websocket thread iterates without a lock
+        self._clients: typing.Tuple["CoinbaseClient", ...] = tuple()
+        self._clients_lock = threading.Lock()
+
+        self._ws: typing.Optional[websocket.WebSocketApp] = None
+        self._ws_thread: typing.Optional[threading.Thread] = None
+        self._reconnect = True
+        # set by stop(), also cuts the backoff between two reconnections short
+        self._stopped = threading.Event()
+        # reconnection attempts since the last successful connection, used for the backoff in _start_ws
+        self._reconnect_attempts = 0
+        # sequence_num is a counter over the whole connection, a jump means messages were dropped
+        self._last_sequence = None
+        # exchange timestamp of the last message of each channel and of the last message of any channel, gaps are
+        # measured in exchange time only so a local clock off by a few seconds doesn't move them
+        self._last_channel_ts: typing.Dict[str, float] = dict()
+        self._last_message_ts = None
+        # start of the last gap handed to the clients, the same gap found twice (by the sequence numbers and then by
+        # the reconnection) is only resynced once
+        self._reported_gap_start = None
+        # seconds without a message on a channel that are treated as a gap in the feed
+        self.gap_threshold = 30
+
+        self.logger = logger
+
+    def register(self, client: "CoinbaseClient"):
+        with self._clients_lock:
+            if client not in self._clients:
+                self._clients = self._clients + (client,)
+
+    def unregister(self, client: "CoinbaseClient"):
+        with self._clients_lock:
+            self._clients = tuple(registered for registered in self._clients if registered is not client)
+
+    @property
+    def clients(self) -> typing.List["CoinbaseClient"]:
+        return list(self._clients)
+
+    def start(self):
+        """Starts the websocket thread, the clients sharing the feed call it too so only the first call does it."""
+        with self._clients_lock:
+            if self._ws_thread is not None:
+                return
+            self._ws_thread = threading.Thread(target=self._start_ws)
+        self._ws_thread.start()
+
+    def _dispatch(self, handler: str, *args):
+        # an error in one account must not stop the others from getting the message
+        for client in self._clients:
+            try:
+                getattr(client, handler)(*args)
+            except Exception as err:
+                self.logger.error(f'Error in {handler} of the client {client._public_key[:8]}: {err}')
+
+    def _start_ws(self):
+        self._ws = websocket.WebSocketApp(self._ws_url, on_open=self._on_open, on_close=self._on_close,
+                                          on_error=self._on_error, on_message=self._on_message)
+        while True:
+            try:
+                if self._reconnect:
+                    self._ws.run_forever()
+                else:
+                    break
+
+            except Exception as err:
+                self.logger.error(f'Coinbase websocket error in run_forever method: {err}')
+
+            # exponential backoff with jitter, the first retry is almost immediate and many clients reconnecting
+            # after an exchange side disconnect don't all hit it at the same moment
+            delay = min(30.0, 0.5 * 2 ** self._reconnect_attempts) * random.uniform(0.5, 1.0)
+            self._reconnect_attempts += 1
+            if self._stopped.wait(delay):
+                break
+
+    def stop(self, timeout: float = 5.0):
+        """Closes the websocket, waits for the message being handled then writes the buffered trades of the tape."""
+        self._reconnect = False
+        self._stopped.set()
+        if self._ws is not None:
+            try:
+                self._ws.close()
+            except Exception as err:
+                self.logger.error(f'Error while closing the Coinbase websocket: {err}')
+        if self._ws_thread is not None:
+            self._ws_thread.join(timeout)
+        self.tape.flush()
+
+    def _on_open(self, ws):
+        self.logger.info('Coinbase connection opened')
+        self._reconnect_attempts = 0
+        self._last_sequence = None
+        # the reconnection reports the silence of the channels below, they must not report it a second time
+        self._last_channel_ts.clear()
+
+        self.subscribe_channel(list(self.assets.values())[:len(self.assets) - 2], 'ticker')
+        self.subscribe_channel(list(self.assets.values())[:len(self.assets) - 2], 'market_trades')
+
+        # reconnection: everything since the last message we got was missed
+        if self._last_message_ts is not None:
+            self._report_gap(self._last_message_ts)
+
+    def _on_close(self, ws, *args):
+        # newer websocket-client versions also pass the close status code and message
+        self.logger.warning('Coinbase connection closed')
+
+    def _on_error(self, ws, msg: str):
+        self.logger.error(f'Coinbase connection error: {msg}')
+
+    def _on_message(self, ws, msg: str):
+        """Decodes the websocket messages, updates the shared prices and tape then hands them to the clients"""
+        data = json.loads(msg)
+        self._check_gap(data)
+
+        if 'channel' in data and data['channel'] == 'ticker':
+            symbol = data['events'][0]['tickers'][0]['product_id']
+            price = float(data['events'][0]['tickers'][0]['price'])
+            self.prices.set_quote(symbol, bid=price, ask=price, last=price)
+            self._dispatch('_on_ticker', symbol, price)
+
+        # IF THERE IS A PROBLEM LATER ON, NOTED HERE THAT THIS CHANNEL GIVEs SELL SIDE INFO, NOT SURE HOW THIS WILL
+        # AFFECT FINAL PRODUCT
+        elif 'channel' in data and data['channel'] == 'market_trades':
+            symbol = data['events'][0]['trades'][0]['product_id']
+            # convert iso8601 datetime format to a unix timestamp in milliseconds
+            ts = int(dateutil.parser.isoparse(data['timestamp']).timestamp())
+
+            # (symbol, price, size) of every trade of the message
+            trades: typing.List[typing.Tuple[str, float, float]] = []
+            # lowest and highest price of the message by symbol, enough to know which exit levels were crossed
+            price_ranges: typing.Dict[str, typing.List[float]] = dict()
+
+            for event in data['events']:
+                for trade in event['trades']:
+                    price = float(trade['price'])
+                    size = float(trade['size'])
+                    self.tape.append(trade['product_id'], dateutil.parser.isoparse(trade['time']).timestamp(),
+                                     price, size, trade['side'], trade.get('trade_id'))
+                    trades.append((trade['product_id'], price, size))
+
+                    price_range = price_ranges.setdefault(trade['product_id'], [price, price])
+                    price_range[0] = min(price_range[0], price)
+                    price_range[1] = max(price_range[1], price)
+
+            self._dispatch('_on_market_trades', trades, price_ranges)
+            self._dispatch('_on_market_trade', symbol, trades[0][1], trades[0][2], ts)
+
+    def _check_gap(self, data: typing.Dict):
+        """Detects dropped messages from the sequence numbers and silent channels from the message timestamps."""
+        gap_start = None
+
+        sequence = data.get('sequence_num')
+        if sequence is not None:
+            if self._last_sequence is not None and sequence > self._last_sequence + 1:
+                self.logger.warning(f'Coinbase feed gap: {sequence - self._last_sequence - 1} messages missed')
+                gap_start = self._last_message_ts
+            self._last_sequence = sequence
+
+        if 'timestamp' in data:
+            ts = dateutil.parser.isoparse(data['timestamp']).timestamp()
+
+            channel = data.get('channel')
+            if channel in ['ticker', 'market_trades']:
+                last_ts = self._last_channel_ts.get(channel)
+                if last_ts is not None and ts - last_ts > self.gap_threshold:
+                    self.logger.warning(f'Coinbase feed gap: no {channel} message for {ts - last_ts:.0f} seconds')
+                    gap_start = last_ts if gap_start is None else min(gap_start, last_ts)
+                self._last_channel_ts[channel] = ts
+
+            self._last_message_ts = ts if self._last_message_ts is None else max(self._last_message_ts, ts)
+
+        if gap_start is not None:
+            self._report_gap(gap_start)
+
+    def _report_gap(self, gap_start: float):
+        if gap_start == self._reported_gap_start:
+            return
+        self._reported_gap_start = gap_start
+        self._dispatch('_on_gap', gap_start)
+
+    def subscribe_channel(self, assets: typing.List[Asset], channel: str):
+        data = dict()
+        data['type'] = 'subscribe'
+        data['product_ids'] = []
+        for asset in assets:
+            data['product_ids'].append(asset.symbol)
+        data['channel'] = channel
+        data['api_key'] = self._client._public_key
+        data['timestamp'] = str(int(time.time()))
+        data['signature'] = self._client._create_signature(data['channel'], ','.join(data['product_ids']),
+                                                           data['timestamp'], dict())
+
+        try:
+            self._ws.send(json.dumps(data))
+        except Exception as err:
+            self.logger.error(f'Websocket error while subscribing to {len(assets) - 2} {channel} updates: {err}')
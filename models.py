@@ -1,48 +1,109 @@
+import math
+import typing
+
+# Every model uses __slots__: no per-instance __dict__, which makes the candles and trades kept in memory smaller and
+# attribute access a little faster. The numbers sent as strings by Coinbase are parsed once here, the
+# rest of the code only sees floats and ints; Asset formats them back to exchange strings when an order is sent.
+
+
+def _decimals(increment: str) -> int:
+    """Number of decimals of an increment sent by Coinbase, '0.01' -> 2, '1' -> 0."""
+    if '.' not in increment:
+        return 0
+    return len(increment.split('.')[1].rstrip('0'))
+
 
 class Balance:
+    __slots__ = ('wallet_balance', 'UUID')
+
     def __init__(self, info):
-        self.wallet_balance = float(info['available_balance']['value'])
-        self.UUID = info['uuid']
+        self.wallet_balance: float = float(info['available_balance']['value'])
+        self.UUID: str = info['uuid']
 
 
 class Asset:
+    """A product. Prices are multiples of quote_tick and sizes multiples of base_tick, the *_ticks methods turn them
+    into exact integers (price_to_ticks(30000.01) == 3000001 with a 0.01 tick) for comparisons and arithmetic without
+    float rounding, the format_* methods give the strings the order endpoints expect."""
+    __slots__ = ('symbol', 'base_asset', 'quote_asset', 'quote_increment', 'base_increment', 'quote_tick', 'base_tick')
+
     def __init__(self, contract_info):
-        self.symbol = contract_info['product_id']
-        self.base_asset = contract_info['base_currency_id']
-        self.quote_asset = contract_info['quote_currency_id']
-        self.quote_increment = len(contract_info['quote_increment'].split('.')[1])
-        if '.' in contract_info['base_increment']:
-            self.base_increment = len(contract_info['base_increment'].split('.')[1])
-        else:
-            self.base_increment = None
+        self.symbol: str = contract_info['product_id']
+        self.base_asset: str = contract_info['base_currency_id']
+        self.quote_asset: str = contract_info['quote_currency_id']
+        # number of decimals of the prices and the sizes
+        self.quote_increment: int = _decimals(contract_info['quote_increment'])
+        self.base_increment: typing.Optional[int] = _decimals(contract_info['base_increment']) \
+            if '.' in contract_info['base_increment'] else None
+        self.quote_tick: float = float(contract_info['quote_increment'])
+        self.base_tick: float = float(contract_info['base_increment'])
+
+    def price_to_ticks(self, price: float) -> int:
+        return int(round(price / self.quote_tick))
+
+    def ticks_to_price(self, ticks: int) -> float:
+        return round(ticks * self.quote_tick, self.quote_increment)
+
+    def size_to_ticks(self, size: float) -> int:
+        # sizes are rounded down, an order can't be bigger than the balance it was computed from
+        return int(math.floor(size / self.base_tick + 1e-9))
+
+    def ticks_to_size(self, ticks: int) -> float:
+        return round(ticks * self.base_tick, self.base_increment or 0)
+
+    def format_price(self, price: float) -> str:
+        """Price or quote currency amount as the exchange expects it."""
+        return f'{self.ticks_to_price(self.price_to_ticks(price)):.{self.quote_increment}f}'
+
+    def format_size(self, size: float) -> str:
+        """Base currency size as the exchange expects it, rounded down to the base increment."""
+        return f'{self.ticks_to_size(self.size_to_ticks(size)):.{self.base_increment or 0}f}'
 
 
 class Candle:
+    __slots__ = ('timestamp', 'open', 'high', 'low', 'close', 'volume')
+
     def __init__(self, candle_info):
 
-        self.timestamp = int(candle_info['start'])
-        self.open = float(candle_info['open'])
-        self.high = float(candle_info['high'])
-        self.low = float(candle_info['low'])
-        self.close = float(candle_info['close'])
-        self.volume = float(candle_info['volume'])
+        self.timestamp: int = int(candle_info['start'])
+        self.open: float = float(candle_info['open'])
+        self.high: float = float(candle_info['high'])
+        self.low: float = float(candle_info['low'])
+        self.close: float = float(candle_info['close'])
+        self.volume: float = float(candle_info['volume'])
 
 
 class OrderStatus:
+    __slots__ = ('order_id', 'status', 'avg_price')
+
     def __init__(self, order_info):
-        self.order_id = order_info['order_id']
-        self.status = order_info['status']
-        self.avg_price = order_info['average_filled_price']
+        self.order_id: str = order_info['order_id']
+        self.status: str = order_info['status']
+        # can be empty while the order has no fill
+        self.avg_price: typing.Optional[float] = float(order_info['average_filled_price']) \
+            if order_info.get('average_filled_price') not in (None, '') else None
 
 
 class Trade:
+    __slots__ = ('time', 'asset', 'strategy', 'side', '_entry_price', 'status', 'pnl', 'quantity', 'entry_id')
+
     def __init__(self, trade_info):
         self.time: int = trade_info['time']
         self.asset: Asset = trade_info['asset']
         self.strategy: str = trade_info['strategy']
         self.side: str = trade_info['side']
-        self.entry_price: float = trade_info['entry_price']
+        self.entry_price: typing.Optional[float] = trade_info['entry_price']
         self.status: str = trade_info['status']
         self.pnl: float = trade_info['pnl']
-        self.quantity = trade_info['quantity']
-        self.entry_id: int = trade_info['entry_id']
+        # quote currency for long trades, base currency for short trades
+        self.quantity: float = float(trade_info['quantity'])
+        self.entry_id: str = trade_info['entry_id']
+
+    @property
+    def entry_price(self) -> typing.Optional[float]:
+        """Average fill price of the entry order, None until it is filled."""
+        return self._entry_price
+
+    @entry_price.setter
+    def entry_price(self, price: typing.Optional[float]):
+        self._entry_price = float(price) if price is not None else None
@@ -0,0 +1,157 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import heapq
+from interfaces.logging_component import logger
+import itertools
+import json
+from rate_limiter import RateLimiter
+import threading
+import time
+import typing
+
+# lower goes first: a burst of entries never delays the exit of a losing trade. Cancels are sent as stop losses
+PRIORITY_STOP_LOSS = 0
+PRIORITY_TAKE_PROFIT = 1
+PRIORITY_ENTRY = 2
+# status polls, balances, candles...
+PRIORITY_DEFAULT = 3
+
+PRIORITY_NAMES = {PRIORITY_STOP_LOSS: 'stop_loss', PRIORITY_TAKE_PROFIT: 'take_profit', PRIORITY_ENTRY: 'entry',
+                  PRIORITY_DEFAULT: 'default'}
+# requests of this priority or more urgent are sent by workers of their own
+PRIORITY_URGENT = PRIORITY_TAKE_PROFIT
+
+
+class _Request:
+    __slots__ = ('method', 'endpoint', 'data', 'priority', 'key', 'queued', 'future', 'dispatched')
+
+    def __init__(self, method: str, endpoint: str, data: typing.Dict, priority: int, key):
+        self.method = method
+        self.endpoint = endpoint
+        self.data = data
+        self.priority = priority
+        self.key = key
+        self.queued = time.monotonic()
+        self.future = Future()
+        self.dispatched = False
+
+
+class OrderGateway:
+    """Every REST request of the client goes through here. Requests wait in a priority queue and are sent one token of
+    the RateLimiter at a time, the request taken from the queue when a token frees up is always the most urgent one
+    (see the PRIORITY_ constants), so stop loss exits are never stuck behind entries or status polls when the client
+    runs close to the exchange limit. Once taken from the queue, the exits and cancels (PRIORITY_URGENT) are sent by a
+    pool of workers only they use, slow or stuck HTTP calls of the other requests can't leave them without a worker.
+
+    Identical GET requests waiting at the same time (the same order status polled by two threads, the balances asked
+    for by several strategies) are sent once and all the callers get the same response. A request already sent is not
+    joined, its response may have left the exchange before the change the new caller is waiting for.
+
+    request() blocks the calling thread until the response arrived, like a plain requests call."""
+    def __init__(self, send: typing.Callable[[str, str, typing.Dict], typing.Any], rate_limiter: RateLimiter,
+                 max_workers: int = 10, urgent_workers: int = 4, report_interval: float = 60):
+        self._send = send
+        self._rate_limiter = rate_limiter
+        # the HTTP calls run here so a slow response doesn't hold back the next request
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._urgent_executor = ThreadPoolExecutor(max_workers=urgent_workers)
+        self.report_interval = report_interval
+
+        # (priority, sequence, request), a coalesced request can be in the heap twice with two priorities
+        self._heap: typing.List[typing.Tuple[int, int, _Request]] = []
+        self._sequence = itertools.count()
+        # key -> GET request waiting in the queue
+        self._pending: typing.Dict[typing.Tuple, _Request] = dict()
+        self._condition = threading.Condition()
+
+        # priority -> [requests sent, requests coalesced, total queueing delay, max queueing delay]
+        self._stats: typing.Dict[int, typing.List[float]] = {priority: [0, 0, 0.0, 0.0] for priority in PRIORITY_NAMES}
+        self._last_report = time.monotonic()
+
+        self._thread = threading.Thread(target=self._run, name='order-gateway', daemon=True)
+        self._thread.start()
+
+    def request(self, method: str, endpoint: str, data: typing.Dict, priority: int = PRIORITY_DEFAULT):
+        key = (method, endpoint, json.dumps(data, sort_keys=True)) if method == 'GET' else None
+
+        with self._condition:
+            request = self._pending.get(key) if key is not None else None
+            if request is not None and not request.dispatched:
+                self._stats[priority][1] += 1
+                # the request inherits the most urgent priority of its callers
+                if priority < request.priority:
+                    request.priority = priority
+                    heapq.heappush(self._heap, (priority, next(self._sequence), request))
+            else:
+                request = _Request(method, endpoint, data, priority, key)
+                if key is not None:
+                    self._pending[key] = request
+                heapq.heappush(self._heap, (priority, next(self._sequence), request))
+                self._condition.notify()
+
+        return request.future.result()
+
+    def _discard_stale(self):
+        # entries left behind by a request whose priority was raised, called with the condition held
+        while len(self._heap) > 0 and (self._heap[0][2].dispatched or self._heap[0][0] != self._heap[0][2].priority):
+            heapq.heappop(self._heap)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._discard_stale()
+                while len(self._heap) == 0:
+                    self._condition.wait()
+                    self._discard_stale()
+                # taken out before waiting for the token, so a token is never spent on a queue with nothing to send
+                entry = heapq.heappop(self._heap)
+
+            self._rate_limiter.acquire()
+
+            with self._condition:
+                # a more urgent request arrived while waiting for the token: it gets the token and this one goes back
+                self._discard_stale()
+                if len(self._heap) > 0 and self._heap[0][:2] < entry[:2]:
+                    entry = heapq.heappushpop(self._heap, entry)
+                request = entry[2]
+                request.dispatched = True
+
+                delay = time.monotonic() - request.queued
+                stats = self._stats[request.priority]
+                stats[0] += 1
+                stats[2] += delay
+                stats[3] = max(stats[3], delay)
+
+            executor = self._urgent_executor if request.priority <= PRIORITY_URGENT else self._executor
+            executor.submit(self._dispatch, request)
+
+            if time.monotonic() - self._last_report >= self.report_interval:
+                self._last_report = time.monotonic()
+                logger.info(f'Order gateway queueing delay: {self.stats()}')
+
+    def _dispatch(self, request: _Request):
+        try:
+            result = self._send(request.method, request.endpoint, request.data)
+        except Exception as err:
+            logger.error(f'Error while sending {request.method} request to {request.endpoint}: {err}')
+            result = None
+        finally:
+            if request.key is not None:
+                with self._condition:
+                    # a newer request with the same key may have been queued once this one was sent
+                    if self._pending.get(request.key) is request:
+                        del self._pending[request.key]
+
+        request.future.set_result(result)
+
+    def stats(self) -> typing.Dict[str, typing.Dict[str, float]]:
+        """Requests sent, requests coalesced into another one and average/max seconds spent in the queue, by
+        priority class."""
+        with self._condition:
+            return {PRIORITY_NAMES[priority]: {'requests': int(sent), 'coalesced': int(coalesced),
+                                               'avg_delay': total_delay / sent if sent > 0 else 0,
+                                               'max_delay': max_delay}
+                    for priority, (sent, coalesced, total_delay, max_delay) in self._stats.items()}
+
+    def queue_length(self) -> int:
+        with self._condition:
+            return len({id(request) for _, _, request in self._heap if not request.dispatched})
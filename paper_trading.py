@@ -0,0 +1,227 @@
+from models import *
+from interfaces.logging_component import logger
+import itertools
+import threading
+import time
+import typing
+
+
+class PaperOrder:
+    def __init__(self, order_id: str, asset: Asset, side: str, order_type: str, quantity: float, limit: float,
+                 submitted: float, latency: float):
+        self.order_id = order_id
+        self.asset = asset
+        self.side = side
+        self.order_type = order_type
+        # MARKET BUY: quote currency left to spend, everything else: base currency left to fill
+        self.remaining = quantity
+        self.limit = limit
+        self.submitted = submitted
+        # the exchange doesn't see the order before this time
+        self.active_at = submitted + latency
+        self.status = 'OPEN'
+        # balance held for the part of the order not filled yet, in quote currency for a BUY and base for a SELL
+        self.reserved = 0.0
+
+        self.filled_size = 0.0
+        self.filled_value = 0.0
+        self.fees = 0.0
+        self.completed = None
+
+    def order_status(self) -> OrderStatus:
+        # same fields as the orders/historical endpoint, prices are strings there too
+        avg_price = str(self.filled_value / self.filled_size) if self.filled_size > 0 else ''
+        return OrderStatus({'order_id': self.order_id, 'status': self.status, 'average_filled_price': avg_price})
+
+
+class PaperExecution:
+    """Fill simulator that takes the place of the Coinbase order endpoints when the client is created with
+    paper=PaperExecution(...). Orders never leave the process, they are filled against the live feed:
+
+    - fill_on='trade': an order fills against the trades of the market_trades channel printed after it became active,
+      taking at most participation * the size of each trade (partial fills over several trades), limit orders fill at
+      their limit price once a trade reaches it.
+    - fill_on='quote': market orders fill completely at the ask (BUY) or bid (SELL) of the first ticker update after
+      they became active.
+
+    latency is the number of seconds between the order and the moment it can fill, fee_rate is charged on the value of
+    every fill (Coinbase taker fee by default). An accepted order holds what it can spend (quote amount and fee for a
+    BUY, base amount for a SELL) until it fills or is cancelled, so two orders can't both spend the same balance. The
+    simulated balances are updated on every fill and get_balances returns what is not held, in the same Balance
+    objects as the accounts endpoint."""
+    def __init__(self, balances: typing.Dict[str, float], latency: float = 0.1, fee_rate: float = 0.006,
+                 fill_on: str = 'trade', participation: float = 1.0):
+        if fill_on not in ('trade', 'quote'):
+            raise ValueError(f'fill_on must be trade or quote, not {fill_on!r}')
+
+        self.balances: typing.Dict[str, float] = {currency: float(value) for currency, value in balances.items()}
+        # part of the balances held by the open orders
+        self._reserved: typing.Dict[str, float] = dict()
+        self.latency = latency
+        self.fee_rate = fee_rate
+        self.fill_on = fill_on
+        self.participation = participation
+
+        self.orders: typing.Dict[str, PaperOrder] = dict()
+        # open orders by symbol, the only ones the feed has to look at
+        self._open: typing.Dict[str, typing.List[PaperOrder]] = dict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+        self.fills = 0
+        self._fill_delays: typing.List[float] = []
+
+    # order path, same signatures and return values as the CoinbaseClient methods
+
+    def place_order(self, asset: Asset, side: str, order_type: str, quantity: float, limit: float = None) \
+            -> typing.Optional[OrderStatus]:
+        quantity = float(quantity)
+        if order_type == 'LIMIT' and limit is None:
+            logger.warning(f'Paper trading: LIMIT order on {asset.symbol} without a limit price')
+            return None
+
+        base_asset, quote_asset = asset.symbol.split('-')
+        with self._lock:
+            # MARKET BUY quantity is in quote currency and includes the fee, a LIMIT BUY needs base size * limit of it
+            # plus the fee
+            if side == 'BUY':
+                needed = quantity if order_type == 'MARKET' else quantity * float(limit) * (1 + self.fee_rate)
+                currency = quote_asset
+            else:
+                needed, currency = quantity, base_asset
+            if self._available(currency) < needed:
+                logger.warning(f'Paper trading: insufficient {currency} balance for {side} order on {asset.symbol}')
+                return None
+
+            order = PaperOrder(f'paper-{next(self._ids)}', asset, side, order_type, quantity,
+                               float(limit) if limit is not None else None, time.time(), self.latency)
+            order.reserved = needed
+            self._reserved[currency] = self._reserved.get(currency, 0) + needed
+            self.orders[order.order_id] = order
+            self._open.setdefault(asset.symbol, []).append(order)
+
+            return order.order_status()
+
+    def get_order_status(self, order_id: str) -> typing.Optional[OrderStatus]:
+        with self._lock:
+            order = self.orders.get(order_id)
+            return order.order_status() if order is not None else None
+
+    def cancel_orders(self, order_ids: typing.List[str]) -> typing.Dict[str, OrderStatus]:
+        results = dict()
+        with self._lock:
+            for order_id in order_ids:
+                order = self.orders.get(order_id)
+                if order is None or order.status != 'OPEN':
+                    logger.warning(f'Failure of cancel_orders method for order_id: {order_id}')
+                    results[order_id] = None
+                    continue
+                order.status = 'CANCELLED'
+                self._open[order.asset.symbol].remove(order)
+                self._release(order, order.reserved)
+                results[order_id] = order.order_status()
+        return results
+
+    def get_balances(self) -> typing.Dict[str, Balance]:
+        with self._lock:
+            return {currency: Balance({'available_balance': {'value': str(self._available(currency)),
+                                                             'currency': currency},
+                                       'uuid': f'paper-{currency}'})
+                    for currency in self.balances}
+
+    def _available(self, currency: str) -> float:
+        return self.balances.get(currency, 0) - self._reserved.get(currency, 0)
+
+    def _release(self, order: PaperOrder, amount: float):
+        """Gives back amount of the balance held by the order, called with the lock held."""
+        amount = min(amount, order.reserved)
+        currency = order.asset.symbol.split('-')[1 if order.side == 'BUY' else 0]
+        order.reserved -= amount
+        self._reserved[currency] = max(0.0, self._reserved.get(currency, 0) - amount)
+
+    # feed hooks
+
+    def on_trade(self, symbol: str, price: float, size: float):
+        if self.fill_on != 'trade' or symbol not in self._open:
+            return
+        with self._lock:
+            now = time.time()
+            # the liquidity of one trade is shared by the orders in the order they were sent
+            liquidity = size * self.participation
+            for order in list(self._open[symbol]):
+                if liquidity <= 0:
+                    break
+                if order.active_at > now:
+                    continue
+                if order.order_type == 'LIMIT':
+                    if (order.side == 'BUY' and price > order.limit) or (order.side == 'SELL' and price < order.limit):
+                        continue
+                    liquidity -= self._fill(order, order.limit, liquidity, now)
+                else:
+                    liquidity -= self._fill(order, price, liquidity, now)
+
+    def on_quote(self, symbol: str, bid: float, ask: float):
+        if self.fill_on != 'quote' or symbol not in self._open:
+            return
+        with self._lock:
+            now = time.time()
+            for order in list(self._open[symbol]):
+                if order.active_at > now:
+                    continue
+                price = ask if order.side == 'BUY' else bid
+                if order.order_type == 'LIMIT':
+                    if (order.side == 'BUY' and price > order.limit) or (order.side == 'SELL' and price < order.limit):
+                        continue
+                    price = order.limit
+                self._fill(order, price, float('inf'), now)
+
+    def _fill(self, order: PaperOrder, price: float, liquidity: float, now: float) -> float:
+        """Fills as much of the order as the liquidity (in base currency) allows and returns the base size filled."""
+        base_asset, quote_asset = order.asset.symbol.split('-')
+
+        if order.side == 'BUY' and order.order_type == 'MARKET':
+            # the quote size includes the fee
+            size = min(order.remaining / (price * (1 + self.fee_rate)), liquidity)
+        else:
+            size = min(order.remaining, liquidity)
+        if size <= 0:
+            return 0
+
+        value = size * price
+        fee = value * self.fee_rate
+
+        if order.side == 'BUY':
+            self.balances[quote_asset] = self.balances.get(quote_asset, 0) - value - fee
+            self.balances[base_asset] = self.balances.get(base_asset, 0) + size
+            order.remaining -= (value + fee) if order.order_type == 'MARKET' else size
+            self._release(order, value + fee)
+        else:
+            self.balances[base_asset] = self.balances.get(base_asset, 0) - size
+            self.balances[quote_asset] = self.balances.get(quote_asset, 0) + value - fee
+            order.remaining -= size
+            self._release(order, size)
+
+        order.filled_size += size
+        order.filled_value += value
+        order.fees += fee
+        self.fills += 1
+
+        # what is left can't buy anything anymore (rounding)
+        if order.remaining <= 1e-12 * max(1.0, order.filled_value):
+            order.remaining = 0
+            # rounding left over
+            self._release(order, order.reserved)
+            order.status = 'FILLED'
+            order.completed = now
+            self._open[order.asset.symbol].remove(order)
+            self._fill_delays.append(now - order.submitted)
+
+        return size
+
+    def stats(self) -> typing.Dict[str, float]:
+        """Orders sent, fills, fees paid and the average/max seconds between an order and its complete fill."""
+        with self._lock:
+            return {'orders': len(self.orders), 'open_orders': sum(len(orders) for orders in self._open.values()),
+                    'fills': self.fills, 'fees': sum(order.fees for order in self.orders.values()),
+                    'avg_fill_delay': sum(self._fill_delays) / len(self._fill_delays) if self._fill_delays else 0,
+                    'max_fill_delay': max(self._fill_delays, default=0)}
@@ -0,0 +1,206 @@
+from collections.abc import MutableMapping
+from interfaces.logging_component import logger
+from multiprocessing import shared_memory
+import numpy as np
+import threading
+import time
+import typing
+
+# one fixed size record per symbol, seq is the seqlock counter: odd while a write is in progress, 0 if the symbol
+# never got a price
+PRICE_DTYPE = np.dtype([('seq', np.uint64), ('bid', np.float64), ('ask', np.float64), ('last', np.float64),
+                        ('timestamp', np.float64)])
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before python 3.13 there is no track argument, processes started by multiprocessing share the resource
+        # tracker of their parent so attaching doesn't change who unlinks the block
+        return shared_memory.SharedMemory(name=name)
+
+
+class _PriceRow(MutableMapping):
+    """What table[symbol] returns, behaves like the {'bid': .., 'ask': ..} dicts the prices dict used to hold. Every
+    item read is its own snapshot, use PriceTable.snapshot() to get bid and ask from the same update."""
+    def __init__(self, table: "PriceTable", symbol: str):
+        self._table = table
+        self._symbol = symbol
+
+    def __getitem__(self, field: str) -> float:
+        snapshot = self._table.snapshot(self._symbol)
+        if snapshot is None or field not in snapshot:
+            raise KeyError(field)
+        return snapshot[field]
+
+    def __setitem__(self, field: str, value: float):
+        if field not in PriceTable.FIELDS:
+            raise KeyError(field)
+        self._table.set_quote(self._symbol, **{field: value})
+
+    def __delitem__(self, field: str):
+        raise TypeError('Price fields can not be deleted')
+
+    def __iter__(self):
+        return iter(PriceTable.FIELDS)
+
+    def __len__(self) -> int:
+        return len(PriceTable.FIELDS)
+
+    def __repr__(self) -> str:
+        return repr(self._table.snapshot(self._symbol))
+
+
+class PriceTable(MutableMapping):
+    """Best bid/ask, last price and update time of every symbol in a structured numpy array, indexed by a stable symbol
+    id. There is a single writer at a time (guarded by a lock) and readers never lock: a seqlock counter per row lets
+    them detect a write in progress and retry, so a snapshot is never torn. With shared=True the array lives in
+    multiprocessing.shared_memory and other processes can read it zero-copy with PriceTable.attach(name, symbols).
+
+    It is also a MutableMapping with the symbol as key so existing code written for the old dict of dicts
+    (prices[symbol]['bid'], symbol in prices, prices[symbol] = {'bid': .., 'ask': ..}) keeps working."""
+    FIELDS = ('bid', 'ask', 'last', 'timestamp')
+
+    def __init__(self, symbols: typing.List[str], capacity: int = None, shared: bool = False, name: str = None):
+        symbols = list(symbols)
+        # leave room for symbols listed after the table was created (e.g. a new product)
+        self.capacity = capacity if capacity is not None else max(len(symbols) * 2, 16)
+        self._ids: typing.Dict[str, int] = {symbol: i for i, symbol in enumerate(symbols[:self.capacity])}
+        self._symbols: typing.List[str] = symbols[:self.capacity]
+
+        self._shm = None
+        self._owner = False
+        if name is not None:
+            self._shm = _attach_shared_memory(name)
+            self._array = np.ndarray((self.capacity,), dtype=PRICE_DTYPE, buffer=self._shm.buf)
+        elif shared:
+            self._shm = shared_memory.SharedMemory(create=True, size=PRICE_DTYPE.itemsize * self.capacity)
+            self._owner = True
+            self._array = np.ndarray((self.capacity,), dtype=PRICE_DTYPE, buffer=self._shm.buf)
+            self._array[:] = 0
+        else:
+            self._array = np.zeros(self.capacity, dtype=PRICE_DTYPE)
+
+        # field views on the same memory, indexing a 1-D view is cheaper than indexing the record
+        self._seq = self._array['seq']
+        self._fields = {field: self._array[field] for field in self.FIELDS}
+
+        self._write_lock = threading.Lock()
+        self._full_warning = False
+
+    @classmethod
+    def attach(cls, name: str, symbols: typing.List[str], capacity: int = None) -> "PriceTable":
+        """Opens a table created with shared=True in another process, symbols and capacity must be the same."""
+        return cls(symbols, capacity=capacity, name=name)
+
+    @property
+    def name(self) -> typing.Optional[str]:
+        """Name of the shared memory block, None if the table is not shared."""
+        return self._shm.name if self._shm is not None else None
+
+    @property
+    def symbols(self) -> typing.List[str]:
+        """Every symbol that has a row, in row order."""
+        return list(self._symbols)
+
+    def symbol_id(self, symbol: str) -> typing.Optional[int]:
+        return self._ids.get(symbol)
+
+    def _add_symbol(self, symbol: str) -> typing.Optional[int]:
+        if len(self._symbols) >= self.capacity:
+            if not self._full_warning:
+                logger.warning(f'Price table is full ({self.capacity} symbols), {symbol} prices are dropped')
+                self._full_warning = True
+            return None
+        self._ids[symbol] = len(self._symbols)
+        self._symbols.append(symbol)
+        return self._ids[symbol]
+
+    def set_quote(self, symbol: str, bid: float = None, ask: float = None, last: float = None,
+                  timestamp: float = None):
+        """Writes the given fields of the symbol, the fields left to None keep their value."""
+        with self._write_lock:
+            i = self._ids.get(symbol)
+            if i is None:
+                i = self._add_symbol(symbol)
+                if i is None:
+                    return
+
+            seq = int(self._seq[i])
+            # odd: readers know a write is in progress
+            self._seq[i] = seq + 1
+            if bid is not None:
+                self._fields['bid'][i] = bid
+            if ask is not None:
+                self._fields['ask'][i] = ask
+            if last is not None:
+                self._fields['last'][i] = last
+            self._fields['timestamp'][i] = timestamp if timestamp is not None else time.time()
+            self._seq[i] = seq + 2
+
+    def snapshot(self, symbol: str) -> typing.Optional[typing.Dict[str, float]]:
+        """Consistent copy of the symbol's prices, None if the symbol never got a price."""
+        i = self._ids.get(symbol)
+        if i is None:
+            return None
+
+        seq = self._seq
+        while True:
+            before = int(seq[i])
+            if before == 0:
+                return None
+            elif before & 1:
+                # writer in the middle of an update
+                continue
+
+            record = self._array[i].copy()
+
+            if int(seq[i]) == before:
+                return {'bid': float(record['bid']), 'ask': float(record['ask']), 'last': float(record['last']),
+                        'timestamp': float(record['timestamp'])}
+
+    def snapshot_all(self) -> np.ndarray:
+        """Copy of the whole table, retried until no row changed while it was being copied."""
+        while True:
+            before = self._seq.copy()
+            if np.any(before & 1):
+                continue
+            table = self._array.copy()
+            if np.array_equal(before, self._seq):
+                return table
+
+    def close(self):
+        """Releases the shared memory block, the process that created it also unlinks it."""
+        if self._shm is not None:
+            self._seq = self._fields = self._array = None
+            self._shm.close()
+            if self._owner:
+                self._shm.unlink()
+            self._shm = None
+
+    # dict compatibility
+
+    def __contains__(self, symbol) -> bool:
+        i = self._ids.get(symbol)
+        return i is not None and int(self._seq[i]) != 0
+
+    def __getitem__(self, symbol: str) -> _PriceRow:
+        if symbol not in self:
+            raise KeyError(symbol)
+        return _PriceRow(self, symbol)
+
+    def __setitem__(self, symbol: str, prices: typing.Dict[str, float]):
+        self.set_quote(symbol, **{field: prices[field] for field in self.FIELDS if field in prices})
+
+    def __delitem__(self, symbol: str):
+        if symbol not in self:
+            raise KeyError(symbol)
+        with self._write_lock:
+            self._seq[self._ids[symbol]] = 0
+
+    def __iter__(self):
+        return iter([symbol for symbol in list(self._symbols) if symbol in self])
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self._seq[:len(self._symbols)]))
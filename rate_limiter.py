@@ -0,0 +1,41 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """Token bucket shared by every thread that makes REST requests. Tokens refill continuously at `rate` per second up
+    to `capacity`, so short bursts are allowed but the long run average never goes above the exchange limit."""
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Takes the tokens if they are available right now, never blocks."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens: float = 1):
+        """Blocks the calling thread until the tokens are available."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                # sleep roughly as long as it takes the missing tokens to drip back in
+                wait = (tokens - self._tokens) / self.rate
+
+            time.sleep(wait)
@@ -0,0 +1,144 @@
+from models import *
+from interfaces.logging_component import logger
+import threading
+import time
+import typing
+
+
+class RiskLimits:
+    """Pre-trade limits, None means the limit is not enforced. Notional limits are in quote currency (USD)."""
+    def __init__(self, max_asset_notional: float = None, max_strategy_notional: float = None,
+                 max_portfolio_notional: float = None, max_open_trades: int = None,
+                 max_strategy_open_trades: int = None, max_daily_loss: float = None):
+        self.max_asset_notional = max_asset_notional
+        self.max_strategy_notional = max_strategy_notional
+        self.max_portfolio_notional = max_portfolio_notional
+        self.max_open_trades = max_open_trades
+        self.max_strategy_open_trades = max_strategy_open_trades
+        self.max_daily_loss = max_daily_loss
+
+
+class RiskManager:
+    """Keeps the exposure per asset, per strategy and for the whole portfolio up to date as trades open, fill and close
+    so every pre-trade check is a handful of dict lookups instead of REST calls."""
+    def __init__(self, limits: RiskLimits = None):
+        self.limits = limits if limits is not None else RiskLimits()
+
+        # exposure in quote currency, keyed by asset symbol and by the strategy object
+        self._asset_notional: typing.Dict[str, float] = dict()
+        self._strategy_notional: typing.Dict[typing.Any, float] = dict()
+        self._portfolio_notional = 0.0
+
+        self._open_trades = 0
+        self._strategy_open_trades: typing.Dict[typing.Any, int] = dict()
+
+        # entry_id of every open trade -> (symbol, strategy, notional) so the exposure can be unwound on close
+        self._trades: typing.Dict[str, typing.Tuple[str, typing.Any, float]] = dict()
+
+        self._day = self._current_day()
+        self.realized_pnl_today = 0.0
+
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _current_day() -> int:
+        return int(time.time() // 86400)
+
+    def _roll_day(self):
+        day = self._current_day()
+        if day != self._day:
+            self._day = day
+            self.realized_pnl_today = 0.0
+
+    def _rejection(self, symbol: str, strategy, notional: float) -> typing.Optional[str]:
+        """Returns the reason the entry would break a limit, None if it doesn't."""
+        limits = self.limits
+
+        if limits.max_daily_loss is not None and -self.realized_pnl_today >= limits.max_daily_loss:
+            return f'daily loss of {-self.realized_pnl_today:.2f} reached the limit of {limits.max_daily_loss}'
+
+        if limits.max_open_trades is not None and self._open_trades >= limits.max_open_trades:
+            return f'{self._open_trades} open trades reached the limit of {limits.max_open_trades}'
+
+        if limits.max_strategy_open_trades is not None and \
+                self._strategy_open_trades.get(strategy, 0) >= limits.max_strategy_open_trades:
+            return f'strategy open trades reached the limit of {limits.max_strategy_open_trades}'
+
+        if limits.max_asset_notional is not None and \
+                self._asset_notional.get(symbol, 0.0) + notional > limits.max_asset_notional:
+            return f'{symbol} exposure would exceed the limit of {limits.max_asset_notional}'
+
+        if limits.max_strategy_notional is not None and \
+                self._strategy_notional.get(strategy, 0.0) + notional > limits.max_strategy_notional:
+            return f'strategy exposure would exceed the limit of {limits.max_strategy_notional}'
+
+        if limits.max_portfolio_notional is not None and \
+                self._portfolio_notional + notional > limits.max_portfolio_notional:
+            return f'portfolio exposure would exceed the limit of {limits.max_portfolio_notional}'
+
+        return None
+
+    def _add(self, symbol: str, strategy, notional: float, trades: int):
+        self._asset_notional[symbol] = self._asset_notional.get(symbol, 0.0) + notional
+        self._strategy_notional[strategy] = self._strategy_notional.get(strategy, 0.0) + notional
+        self._portfolio_notional += notional
+        self._open_trades += trades
+        self._strategy_open_trades[strategy] = self._strategy_open_trades.get(strategy, 0) + trades
+
+    def reserve(self, symbol: str, strategy, notional: float) -> bool:
+        """Checks the limits and books the exposure in one step so two strategies can't both squeeze under a limit.
+        Returns False (and logs why) if the entry is rejected."""
+        with self._lock:
+            self._roll_day()
+            reason = self._rejection(symbol, strategy, notional)
+
+            if reason is not None:
+                logger.warning(f'Risk check rejected entry on {symbol}: {reason}')
+                return False
+
+            self._add(symbol, strategy, notional, 1)
+            return True
+
+    def release(self, symbol: str, strategy, notional: float):
+        """Gives back a reservation when the entry order didn't go through."""
+        with self._lock:
+            self._add(symbol, strategy, -notional, -1)
+
+    def register_trade(self, trade: Trade, strategy, notional: float):
+        """Ties a reservation to the trade that was opened with it."""
+        with self._lock:
+            self._trades[trade.entry_id] = (trade.asset.symbol, strategy, notional)
+
+    def restore_trade(self, trade: Trade, strategy, notional: float):
+        """Books the exposure of a trade that was already open before a restart (see snapshot.py), it never went
+        through reserve() in this process."""
+        with self._lock:
+            if trade.entry_id in self._trades:
+                return
+            self._add(trade.asset.symbol, strategy, notional, 1)
+            self._trades[trade.entry_id] = (trade.asset.symbol, strategy, notional)
+
+    def update_notional(self, trade: Trade, notional: float):
+        """Replaces the reserved notional with the filled one."""
+        with self._lock:
+            if trade.entry_id not in self._trades:
+                return
+            symbol, strategy, old_notional = self._trades[trade.entry_id]
+            self._add(symbol, strategy, notional - old_notional, 0)
+            self._trades[trade.entry_id] = (symbol, strategy, notional)
+
+    def close(self, trade: Trade):
+        """Removes the trade's exposure and books its pnl towards the daily loss."""
+        with self._lock:
+            self._roll_day()
+            if trade.entry_id not in self._trades:
+                return
+            symbol, strategy, notional = self._trades.pop(trade.entry_id)
+            self._add(symbol, strategy, -notional, -1)
+            self.realized_pnl_today += trade.pnl
+
+    def exposure(self) -> typing.Dict[str, typing.Any]:
+        """Snapshot of the current exposure, useful for logging."""
+        with self._lock:
+            return {'portfolio': self._portfolio_notional, 'assets': dict(self._asset_notional),
+                    'open_trades': self._open_trades, 'realized_pnl_today': self.realized_pnl_today}
@@ -0,0 +1,374 @@
+from models import *
+from candle_clock import CandleClock
+from coinbase import CoinbaseClient
+from concurrent.futures import ThreadPoolExecutor
+from indicator_service import IndicatorService
+from interfaces.logging_component import log_to_queue, logger, start_queue_listener
+import multiprocessing
+from multiprocessing.connection import Connection, wait
+from price_table import PriceTable
+from signal_language import RuleSyntaxError
+from strategies import Strategy, create_strategy
+from triggers import TriggerIndex
+import signal
+import threading
+import time
+import typing
+
+# Multi-process deployment: one feed process owns the websocket and decodes the messages, the strategies are sharded
+# by symbol across N worker processes, and one execution process owns the signed REST session and does every order,
+# balance and risk call for all the workers.
+#
+#   feed process --(queue per worker: decoded ticker/trade/price range tuples)--> worker processes
+#   feed process --(shared memory PriceTable, read zero-copy)--> worker processes
+#   worker processes --(pipe per worker: requests/responses)--> execution process
+#
+# Every process has its own GIL so the json decoding, the indicator math of each shard and the REST calls no longer
+# wait on each other.
+
+# methods of CoinbaseClient (and of its RiskManager) a worker is allowed to call in the execution process
+_EXECUTION_METHODS = ['get_trade_size', 'place_order', 'place_orders', 'get_order_status', 'cancel_order',
+                      'cancel_orders', 'get_balances', 'get_historical_candles', 'get_candles_range', 'get_bid_ask']
+_RISK_METHODS = ['reserve', 'release', 'register_trade', 'restore_trade', 'update_notional', 'close', 'exposure']
+
+
+def shard_symbols(symbols: typing.List[str], n_workers: int) -> typing.Dict[str, int]:
+    """Shard number of each symbol, dealt round-robin over the sorted symbols so every worker gets the same number of
+    symbols give or take one (a hash modulo n_workers can put most of a small list on the same worker)."""
+    return {symbol: i % n_workers for i, symbol in enumerate(sorted(symbols))}
+
+
+class _FeedClient(CoinbaseClient):
+    """CoinbaseClient that only decodes the websocket messages and forwards them to the worker owning the symbol."""
+    def __init__(self, public_key: str, secret_key: str, queues: typing.List, symbol_shards: typing.Dict[str, int],
+                 shared_prices: PriceTable):
+        # set before super().__init__ because that starts the websocket thread
+        self._queues = queues
+        self._symbol_shards = symbol_shards
+        self._shared_prices = shared_prices
+        super().__init__(public_key, secret_key)
+
+    def _on_ticker(self, symbol: str, price: float):
+        if symbol in self._symbol_shards:
+            self._shared_prices.set_quote(symbol, bid=price, ask=price, last=price)
+            self._queues[self._symbol_shards[symbol]].put(('ticker', symbol))
+
+    def _on_market_trade(self, symbol: str, price: float, size: float, ts: int):
+        if symbol in self._symbol_shards:
+            self._queues[self._symbol_shards[symbol]].put(('trade', symbol, price, size, ts))
+
+    def _on_price_range(self, symbol: str, low: float, high: float):
+        # the exit levels are armed in the worker running the strategy
+        if symbol in self._symbol_shards:
+            self._queues[self._symbol_shards[symbol]].put(('range', symbol, low, high))
+
+    def _on_gap(self, gap_start: float):
+        # the strategies live in the workers, they resync themselves
+        for queue in self._queues:
+            queue.put(('gap', gap_start))
+
+
+class _ExecutionClient(CoinbaseClient):
+    """The REST side of a CoinbaseClient only: no websocket, no trade tape and no candle clock, the feed process has
+    those. The product catalog is the one the feed process downloaded, and get_bid_ask writes to a table of its own
+    since the shared one has the feed process as its only writer."""
+    def __init__(self, public_key: str, secret_key: str, assets: typing.Dict[str, Asset], symbols: typing.List[str]):
+        self._init_rest(public_key, secret_key)
+        self.assets = assets
+        self.prices = PriceTable(symbols)
+        self.strategies: typing.Dict[int, Strategy] = dict()
+
+        self.logger.info('Coinbase execution client successfully initialized')
+
+
+class _RemoteRisk:
+    """Stands in for the RiskManager inside a worker, the real one lives in the execution process so the limits apply
+    to all shards together. Strategy objects can't cross processes so they are replaced by a key."""
+    def __init__(self, proxy: "ExecutionProxy"):
+        self._proxy = proxy
+
+    def _key(self, strategy: Strategy) -> str:
+        return f'{self._proxy.worker_id}:{id(strategy)}'
+
+    def reserve(self, symbol: str, strategy: Strategy, notional: float) -> bool:
+        return bool(self._proxy.call('risk.reserve', symbol, self._key(strategy), notional))
+
+    def release(self, symbol: str, strategy: Strategy, notional: float):
+        self._proxy.call('risk.release', symbol, self._key(strategy), notional)
+
+    def register_trade(self, trade: Trade, strategy: Strategy, notional: float):
+        self._proxy.call('risk.register_trade', trade, self._key(strategy), notional)
+
+    def restore_trade(self, trade: Trade, strategy: Strategy, notional: float):
+        self._proxy.call('risk.restore_trade', trade, self._key(strategy), notional)
+
+    def update_notional(self, trade: Trade, notional: float):
+        self._proxy.call('risk.update_notional', trade, notional)
+
+    def close(self, trade: Trade):
+        self._proxy.call('risk.close', trade)
+
+
+class ExecutionProxy:
+    """Takes the place of the CoinbaseClient for the strategies of a worker process. Prices are read from the shared
+    PriceTable the feed process writes, everything that needs the signed REST session is forwarded to the execution
+    process."""
+    def __init__(self, worker_id: int, connection: Connection, prices: PriceTable):
+        self.worker_id = worker_id
+        self._connection = connection
+        # one request at a time on the pipe, the order status Timer threads of the strategies also call through here
+        self._lock = threading.Lock()
+
+        # written by the feed process, read here without any copy
+        self.prices = prices
+        self.strategies: typing.Dict[int, Strategy] = dict()
+        # the strategies of a symbol all live in the same worker, so their indicators are shared here
+        self.indicators = IndicatorService()
+        self.candle_clock = CandleClock()
+        self.triggers = TriggerIndex()
+        # exit orders fired by the triggers, sent without blocking the queue of the feed. Only the exits use this pool,
+        # the resync of on_gap runs on its own thread
+        self._exit_executor = ThreadPoolExecutor(max_workers=4)
+        self.risk = _RemoteRisk(self)
+        self.logs = []
+
+        self.assets: typing.Dict[str, Asset] = self.call('assets')
+
+    def call(self, method: str, *args, **kwargs):
+        with self._lock:
+            self._connection.send((method, args, kwargs))
+            result, error = self._connection.recv()
+
+        if error is not None:
+            logger.error(f'Worker {self.worker_id}: error in execution process while calling {method}: {error}')
+            return None
+        return result
+
+    def __getattr__(self, name: str):
+        # get_trade_size, place_order, get_order_status... are all forwarded the same way
+        if name in _EXECUTION_METHODS:
+            return lambda *args, **kwargs: self.call(name, *args, **kwargs)
+        raise AttributeError(name)
+
+    def on_ticker(self, symbol: str):
+        quote = self.prices.snapshot(symbol)
+        if quote is None:
+            return
+        for strategy in self.strategies.values():
+            if strategy.asset.symbol == symbol:
+                strategy.update_pnl(quote['bid'], quote['ask'])
+
+    def on_gap(self, gap_start: float):
+        # in the background, the worker keeps reading the feed while the candles download
+        strategies = list(self.strategies.values())
+        threading.Thread(target=lambda: [strategy.resync(gap_start) for strategy in strategies], daemon=True).start()
+
+    def on_price_range(self, symbol: str, low: float, high: float):
+        if symbol not in self.assets:
+            return
+        for trigger in self.triggers.check(self.assets[symbol], low, high):
+            self._exit_executor.submit(trigger.strategy.on_trigger, trigger.trade, trigger.kind)
+
+    def on_market_trade(self, symbol: str, price: float, size: float, ts: int):
+        for strategy in self.strategies.values():
+            if strategy.asset.symbol == symbol:
+                res = strategy.parse_trade(price, size, ts)
+                strategy.check_trade(res)
+
+
+def _serve_request(coinbase: CoinbaseClient, connection: Connection, lock: threading.Lock, request):
+    method, args, kwargs = request
+    result, error = None, None
+
+    try:
+        if method == 'assets':
+            result = coinbase.assets
+        elif method.startswith('risk.') and method[5:] in _RISK_METHODS:
+            result = getattr(coinbase.risk, method[5:])(*args, **kwargs)
+        elif method in _EXECUTION_METHODS:
+            result = getattr(coinbase, method)(*args, **kwargs)
+        else:
+            error = f'{method} is not an execution method'
+    except Exception as err:
+        error = repr(err)
+
+    with lock:
+        connection.send((result, error))
+
+
+def _init_child(log_queue):
+    log_to_queue(log_queue)
+    # Ctrl+C reaches every process of the terminal, the main process stops the children itself (ShardedDeployment.stop)
+    # so the feed gets to flush its tape
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _execution_main(log_queue, public_key: str, secret_key: str, connections: typing.List[Connection], assets_queue,
+                    symbols: typing.List[str]):
+    _init_child(log_queue)
+    # the catalog is downloaded once, by the feed process
+    coinbase = _ExecutionClient(public_key, secret_key, assets_queue.get(), symbols)
+    locks = {connection: threading.Lock() for connection in connections}
+    # requests of different workers are served in parallel, the order gateway of the client keeps them under the limit
+    # and sends the exits of every worker before the entries
+    executor = ThreadPoolExecutor(max_workers=max(4, 2 * len(connections)))
+
+    connections = list(connections)
+    while len(connections) > 0:
+        for connection in wait(connections):
+            try:
+                request = connection.recv()
+            except EOFError:
+                connections.remove(connection)
+                continue
+            executor.submit(_serve_request, coinbase, connection, locks[connection], request)
+
+
+def _feed_main(log_queue, public_key: str, secret_key: str, queues: typing.List, symbol_shards: typing.Dict[str, int],
+               prices_name: str, stop_event, assets_queue):
+    _init_child(log_queue)
+    shared_prices = PriceTable.attach(prices_name, sorted(symbol_shards))
+    client = _FeedClient(public_key, secret_key, queues, symbol_shards, shared_prices)
+    assets_queue.put(client.assets)
+    stop_event.wait()
+    # closes the websocket and writes the trades still buffered in the tape
+    client.feed.stop()
+
+
+def _worker_main(log_queue, worker_id: int, strategy_configs: typing.Dict[int, typing.Dict], queue,
+                 connection: Connection, prices_name: str, symbols: typing.List[str]):
+    _init_child(log_queue)
+    proxy = ExecutionProxy(worker_id, connection, PriceTable.attach(prices_name, symbols))
+
+    for strategy_index, config in strategy_configs.items():
+        try:
+            strategy = create_strategy(proxy, config)
+        except RuleSyntaxError as err:
+            logger.warning(f'Worker {worker_id}: invalid rule for strategy {strategy_index}: {err}')
+            continue
+
+        strategy.candles = proxy.get_historical_candles(strategy.asset, strategy.timeframe) or []
+        strategy.candles.reverse()
+
+        if len(strategy.candles) == 0:
+            logger.warning(f'Worker {worker_id}: no historical data retrieved for {strategy.asset.symbol}')
+            strategy.stop()
+            continue
+
+        proxy.strategies[strategy_index] = strategy
+        proxy.candle_clock.add(strategy)
+        logger.info(f'Worker {worker_id}: {config["strategy_type"]} strategy ACTIVATED on {config["asset"]} '
+                    f'{config["timeframe"]}')
+
+    proxy.candle_clock.start()
+
+    while True:
+        message = queue.get()
+        if message is None:
+            break
+        elif message[0] == 'ticker':
+            proxy.on_ticker(*message[1:])
+        elif message[0] == 'trade':
+            proxy.on_market_trade(*message[1:])
+        elif message[0] == 'range':
+            proxy.on_price_range(*message[1:])
+        elif message[0] == 'gap':
+            proxy.on_gap(*message[1:])
+
+
+class ShardedDeployment:
+    """Runs the strategies in worker processes. strategy_configs holds the strategy index as key and a trade_strategies
+    entry of the strategy editor as value (see StrategyEditor.add_strategy)."""
+    def __init__(self, public_key: str, secret_key: str, strategy_configs: typing.Dict[int, typing.Dict],
+                 n_workers: int = None):
+        self._public_key = public_key
+        self._secret_key = secret_key
+
+        symbols = sorted(set(config['asset'] for config in strategy_configs.values()))
+        self.n_workers = min(n_workers or multiprocessing.cpu_count(), max(len(symbols), 1))
+
+        # all the strategies of a symbol go to the same worker so every trade is sent to one process only
+        self.symbol_shards = shard_symbols(symbols, self.n_workers)
+        self.shard_configs: typing.List[typing.Dict[int, typing.Dict]] = [dict() for _ in range(self.n_workers)]
+        for strategy_index, config in strategy_configs.items():
+            self.shard_configs[self.symbol_shards[config['asset']]][strategy_index] = config
+
+        # spawn instead of fork, the parent might already be running threads (loggers, timers)
+        self._context = multiprocessing.get_context('spawn')
+        self._processes = []
+        self._queues = []
+        self.prices: typing.Optional[PriceTable] = None
+        # the children log through this queue, the listener writes their records to the log of this process
+        self._log_queue = None
+        self._log_listener = None
+        # tells the feed process to close the websocket and flush its tape
+        self._stop_event = None
+
+    def start(self):
+        worker_connections = []
+        execution_connections = []
+        for _ in range(self.n_workers):
+            worker_end, execution_end = self._context.Pipe()
+            worker_connections.append(worker_end)
+            execution_connections.append(execution_end)
+
+        self._log_queue = self._context.Queue()
+        self._log_listener = start_queue_listener(self._log_queue)
+        self._stop_event = self._context.Event()
+        # product catalog, from the feed process that downloads it to the execution process that serves it
+        assets_queue = self._context.Queue()
+
+        self._queues = [self._context.Queue() for _ in range(self.n_workers)]
+        # created (and unlinked in stop) by this process so the block outlives any child restart
+        self.prices = PriceTable(sorted(self.symbol_shards), shared=True)
+
+        self._processes.append(self._context.Process(target=_execution_main, name='execution', daemon=True,
+                                                     args=(self._log_queue, self._public_key, self._secret_key,
+                                                           execution_connections, assets_queue,
+                                                           sorted(self.symbol_shards))))
+
+        for worker_id in range(self.n_workers):
+            self._processes.append(self._context.Process(target=_worker_main, name=f'worker-{worker_id}', daemon=True,
+                                                         args=(self._log_queue, worker_id,
+                                                               self.shard_configs[worker_id],
+                                                               self._queues[worker_id],
+                                                               worker_connections[worker_id], self.prices.name,
+                                                               sorted(self.symbol_shards))))
+
+        self._processes.append(self._context.Process(target=_feed_main, name='feed', daemon=True,
+                                                     args=(self._log_queue, self._public_key, self._secret_key,
+                                                           self._queues, self.symbol_shards, self.prices.name,
+                                                           self._stop_event, assets_queue)))
+
+        for process in self._processes:
+            process.start()
+
+        logger.info(f'Sharded deployment started: {self.n_workers} workers for {len(self.symbol_shards)} symbols')
+
+    def join(self):
+        for process in self._processes:
+            process.join()
+
+    def stop(self, timeout: float = 10.0):
+        """Stops the feed first (it flushes its tape), then the workers, whose exit closes the pipes the execution
+        process waits on. A process still running after timeout is terminated."""
+        if self._stop_event is not None:
+            self._stop_event.set()
+        for queue in self._queues:
+            queue.put(None)
+
+        deadline = time.time() + timeout
+        # feed first, then the workers, the execution process stops last once their pipes are closed
+        for process in reversed(self._processes):
+            process.join(max(0.0, deadline - time.time()))
+        for process in self._processes:
+            if process.is_alive():
+                logger.warning(f'Sharded deployment: {process.name} process did not stop, terminating it')
+                process.terminate()
+
+        if self.prices is not None:
+            self.prices.close()
+        logger.info('Sharded deployment stopped')
+        if self._log_listener is not None:
+            self._log_listener.stop()
+            self._log_listener = None
@@ -0,0 +1,355 @@
+import indicators
+from indicator_service import INDICATORS as SHARED_INDICATORS
+import numpy as np
+import re
+import typing
+
+# A small declarative language to describe entry signals, e.g.
+#   rsi(14) < 30 and macd(12, 26, 9).cross_up
+#   close > shift(high, 1) and volume > 100
+# A rule is parsed and compiled ONCE into a tree of python closures that evaluate over whole numpy arrays, so the
+# same compiled rule runs live (look at the last closed candle), in a backtest (look at every candle) or in batch over
+# many symbols (pass 2-D arrays, one row per symbol, see indicators.stack_series).
+#
+# Grammar:
+#   expr       := and_expr ('or' and_expr)*
+#   and_expr   := not_expr ('and' not_expr)*
+#   not_expr   := 'not' not_expr | comparison
+#   comparison := arith (('<' | '<=' | '>' | '>=' | '==' | '!=') arith)?
+#   arith      := term (('+' | '-') term)*
+#   term       := unary (('*' | '/') unary)*
+#   unary      := '-' unary | postfix
+#   postfix    := primary ('.' NAME)*
+#   primary    := NUMBER | NAME | NAME '(' [expr (',' expr)*] ')' | '(' expr ')'
+
+
+class RuleSyntaxError(ValueError):
+    pass
+
+
+class EvalContext:
+    """Holds the candle arrays a rule is evaluated on and the indicator values already computed for them. Every rule
+    evaluated with the same context shares the indicators, so rsi(14) is computed once even if 10 rules use it."""
+    def __init__(self, series: typing.Dict[str, np.ndarray], cache: typing.Dict = None):
+        self.series = series
+        self.cache = cache if cache is not None else dict()
+
+    def indicator(self, name: str, params: typing.Tuple, compute: typing.Callable):
+        key = (name, params)
+        if key not in self.cache:
+            self.cache[key] = compute()
+        return self.cache[key]
+
+
+def _macd_outputs(context: EvalContext, fast: int, slow: int, signal: int) -> typing.Dict[str, np.ndarray]:
+    line, signal_line = indicators.macd(context.series['close'], fast, slow, signal)
+    return {'line': line, 'signal': signal_line, 'hist': line - signal_line,
+            'cross_up': indicators.cross_up(line, signal_line), 'cross_down': indicators.cross_down(line, signal_line)}
+
+
+# indicators take literal numbers as parameters (they are part of the cache key), name -> (number of params, function)
+INDICATORS: typing.Dict[str, typing.Tuple[int, typing.Callable]] = {
+    'rsi': (1, lambda context, length: indicators.rsi(context.series['close'], int(length))),
+    'ema': (1, lambda context, span: indicators.ema(context.series['close'], int(span))),
+    'sma': (1, lambda context, length: indicators.sma(context.series['close'], int(length))),
+    'macd': (3, lambda context, fast, slow, signal: _macd_outputs(context, int(fast), int(slow), int(signal))),
+    'bollinger': (2, lambda context, length, k: SHARED_INDICATORS['bollinger'](context.series, int(length), k)),
+    'atr': (1, lambda context, length: SHARED_INDICATORS['atr'](context.series, int(length))['atr']),
+    'vwap': (1, lambda context, length: SHARED_INDICATORS['vwap'](context.series, int(length))['vwap']),
+    'donchian': (1, lambda context, length: SHARED_INDICATORS['donchian'](context.series, int(length))),
+    'stoch_rsi': (4, lambda context, rsi_length, stoch_length, k, d: SHARED_INDICATORS['stoch_rsi'](
+        context.series, int(rsi_length), int(stoch_length), int(k), int(d))),
+}
+
+# outputs of the indicators that have several, read as attributes: macd(12, 26, 9).signal. Checked when the rule is
+# compiled so a typo is rejected by the strategy editor instead of failing on every candle
+OUTPUTS = {'macd': ('line', 'signal', 'hist', 'cross_up', 'cross_down'), 'bollinger': ('middle', 'upper', 'lower'),
+           'donchian': ('upper', 'lower', 'middle'), 'stoch_rsi': ('k', 'd')}
+
+# the output used when an indicator with several outputs is used without an attribute, macd(12, 26, 9) > 0
+DEFAULT_OUTPUTS = {'macd': 'line', 'bollinger': 'middle', 'donchian': 'middle', 'stoch_rsi': 'k'}
+
+# functions take expressions as arguments
+FUNCTIONS: typing.Dict[str, typing.Tuple[int, typing.Callable]] = {
+    'cross_up': (2, indicators.cross_up),
+    'cross_down': (2, indicators.cross_down),
+}
+
+SERIES = ['open', 'high', 'low', 'close', 'volume']
+
+_TOKEN_RE = re.compile(r'\s*(?:(\d+\.?\d*|\.\d+)|([A-Za-z_][A-Za-z_0-9]*)|(<=|>=|==|!=|[<>()+\-*/,.]))')
+
+
+def _tokenize(text: str) -> typing.List[typing.Tuple[str, str]]:
+    tokens = []
+    position = 0
+    text = text.rstrip()
+
+    while position < len(text):
+        match = _TOKEN_RE.match(text, position)
+        if match is None:
+            raise RuleSyntaxError(f'Unexpected character {text[position:].strip()[0]!r} in rule {text!r}')
+        number, name, op = match.groups()
+        if number is not None:
+            tokens.append(('number', number))
+        elif name is not None:
+            tokens.append(('name', name))
+        else:
+            tokens.append(('op', op))
+        position = match.end()
+
+    tokens.append(('end', ''))
+    return tokens
+
+
+def _as_series(value):
+    """An indicator with several outputs used as a plain value falls back to its default output."""
+    if isinstance(value, dict):
+        return value[value['_default']]
+    return value
+
+
+class _Parser:
+    """Recursive descent parser, every parse method returns a closure that takes an EvalContext."""
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.position = 0
+
+    def _peek(self) -> typing.Tuple[str, str]:
+        return self.tokens[self.position]
+
+    def _next(self) -> typing.Tuple[str, str]:
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def _expect(self, value: str):
+        token = self._next()
+        if token[1] != value:
+            raise RuleSyntaxError(f'Expected {value!r} but found {token[1] or "end of rule"!r} in rule {self.text!r}')
+
+    def parse(self) -> typing.Callable:
+        node = self._expr()
+        if self._peek()[0] != 'end':
+            raise RuleSyntaxError(f'Unexpected {self._peek()[1]!r} in rule {self.text!r}')
+        return node
+
+    def _expr(self):
+        node = self._and_expr()
+        while self._peek() == ('name', 'or'):
+            self._next()
+            left, right = node, self._and_expr()
+            node = lambda context, left=left, right=right: _truthy(left(context)) | _truthy(right(context))
+        return node
+
+    def _and_expr(self):
+        node = self._not_expr()
+        while self._peek() == ('name', 'and'):
+            self._next()
+            left, right = node, self._not_expr()
+            node = lambda context, left=left, right=right: _truthy(left(context)) & _truthy(right(context))
+        return node
+
+    def _not_expr(self):
+        if self._peek() == ('name', 'not'):
+            self._next()
+            operand = self._not_expr()
+            return lambda context: ~_truthy(operand(context))
+        return self._comparison()
+
+    def _comparison(self):
+        comparisons = {'<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal, '==': np.equal,
+                       '!=': np.not_equal}
+        node = self._arith()
+        if self._peek()[0] == 'op' and self._peek()[1] in comparisons:
+            compare = comparisons[self._next()[1]]
+            left, right = node, self._arith()
+            # comparisons with NaN (not enough candles yet) are False, numpy already does that
+            node = lambda context: compare(_as_series(left(context)), _as_series(right(context)))
+        return node
+
+    def _arith(self):
+        node = self._term()
+        while self._peek() in [('op', '+'), ('op', '-')]:
+            operation = np.add if self._next()[1] == '+' else np.subtract
+            left, right = node, self._term()
+            node = lambda context, left=left, right=right, operation=operation: \
+                operation(_as_series(left(context)), _as_series(right(context)))
+        return node
+
+    def _term(self):
+        node = self._unary()
+        while self._peek() in [('op', '*'), ('op', '/')]:
+            operation = np.multiply if self._next()[1] == '*' else np.divide
+            left, right = node, self._unary()
+            node = lambda context, left=left, right=right, operation=operation: \
+                operation(_as_series(left(context)), _as_series(right(context)))
+        return node
+
+    def _unary(self):
+        if self._peek() == ('op', '-'):
+            self._next()
+            operand = self._unary()
+            return lambda context: np.negative(_as_series(operand(context)))
+        return self._postfix()
+
+    def _postfix(self):
+        node = self._primary()
+        while self._peek() == ('op', '.'):
+            self._next()
+            kind, attribute = self._next()
+            if kind != 'name':
+                raise RuleSyntaxError(f'Expected an attribute name after "." in rule {self.text!r}')
+            node = self._attribute(node, attribute)
+        return node
+
+    def _attribute(self, node, attribute: str):
+        outputs = getattr(node, 'outputs', None)
+        if outputs is None:
+            raise RuleSyntaxError(f'Only {", ".join(OUTPUTS)} have attributes, found .{attribute} in rule '
+                                  f'{self.text!r}')
+        if attribute not in outputs:
+            raise RuleSyntaxError(f'Unknown attribute {attribute!r}, expected one of {", ".join(outputs)} in rule '
+                                  f'{self.text!r}')
+
+        def get_attribute(context):
+            value = node(context)
+            if not isinstance(value, dict) or attribute not in value:
+                raise RuleSyntaxError(f'Unknown attribute {attribute!r} in rule {self.text!r}')
+            return value[attribute]
+        return get_attribute
+
+    def _primary(self):
+        kind, value = self._next()
+
+        if kind == 'number':
+            number = float(value)
+            return lambda context: number
+
+        elif (kind, value) == ('op', '('):
+            node = self._expr()
+            self._expect(')')
+            return node
+
+        elif kind == 'name':
+            if self._peek() == ('op', '('):
+                return self._call(value)
+            elif value in SERIES:
+                return lambda context: context.series[value]
+            raise RuleSyntaxError(f'Unknown name {value!r} in rule {self.text!r}')
+
+        raise RuleSyntaxError(f'Unexpected {value or "end of rule"!r} in rule {self.text!r}')
+
+    def _arguments(self) -> typing.List[typing.Callable]:
+        self._expect('(')
+        arguments = []
+        if self._peek() != ('op', ')'):
+            arguments.append(self._expr())
+            while self._peek() == ('op', ','):
+                self._next()
+                arguments.append(self._expr())
+        self._expect(')')
+        return arguments
+
+    def _literal_arguments(self, name: str) -> typing.Tuple[float, ...]:
+        self._expect('(')
+        params = []
+        while self._peek() != ('op', ')'):
+            kind, value = self._next()
+            if kind != 'number':
+                raise RuleSyntaxError(f'Parameters of {name} must be numbers in rule {self.text!r}')
+            params.append(float(value))
+            if self._peek() == ('op', ','):
+                self._next()
+        self._expect(')')
+        return tuple(params)
+
+    def _call(self, name: str):
+        if name in INDICATORS:
+            n_params, compute = INDICATORS[name]
+            params = self._literal_arguments(name)
+            if len(params) != n_params:
+                raise RuleSyntaxError(f'{name} takes {n_params} parameters in rule {self.text!r}')
+
+            def indicator(context):
+                value = context.indicator(name, params, lambda: compute(context, *params))
+                if isinstance(value, dict) and '_default' not in value:
+                    value['_default'] = DEFAULT_OUTPUTS[name]
+                return value
+            indicator.outputs = OUTPUTS.get(name)
+            return indicator
+
+        elif name == 'shift':
+            # shift(series, periods): periods must be a literal
+            self._expect('(')
+            operand = self._expr()
+            self._expect(',')
+            kind, periods = self._next()
+            if kind != 'number':
+                raise RuleSyntaxError(f'The periods of shift must be a number in rule {self.text!r}')
+            self._expect(')')
+            return lambda context: indicators.shift(_as_series(operand(context)), int(float(periods)))
+
+        elif name in FUNCTIONS:
+            n_args, function = FUNCTIONS[name]
+            arguments = self._arguments()
+            if len(arguments) != n_args:
+                raise RuleSyntaxError(f'{name} takes {n_args} arguments in rule {self.text!r}')
+            return lambda context: function(*[_as_series(argument(context)) for argument in arguments])
+
+        raise RuleSyntaxError(f'Unknown function {name!r} in rule {self.text!r}')
+
+
+def _truthy(value) -> np.ndarray:
+    value = np.asarray(_as_series(value))
+    if value.dtype == bool:
+        return value
+    # a plain number/series used as a condition is True when it is above 0
+    return np.nan_to_num(value) > 0
+
+
+class CompiledRule:
+    def __init__(self, text: str):
+        self.text = text
+        self._evaluate = _Parser(text).parse()
+
+    def evaluate(self, context: EvalContext) -> np.ndarray:
+        """Returns a boolean array with the same shape as the series in the context, True where the rule holds."""
+        return np.broadcast_to(_truthy(self._evaluate(context)), context.series['close'].shape)
+
+
+class SignalProgram:
+    """A long rule and a short rule compiled together, they share the indicators of the context they run on."""
+    def __init__(self, long_rule: str, short_rule: str):
+        self.long_rule = compile_rule(long_rule) if long_rule else None
+        self.short_rule = compile_rule(short_rule) if short_rule else None
+
+    def evaluate(self, context: EvalContext) -> np.ndarray:
+        """Returns an int array of signals: 1 long, -1 short, 0 nothing (long wins if both rules hold)."""
+        signals = np.zeros(context.series['close'].shape, dtype=np.int8)
+        if self.short_rule is not None:
+            signals[self.short_rule.evaluate(context)] = -1
+        if self.long_rule is not None:
+            signals[self.long_rule.evaluate(context)] = 1
+        return signals
+
+    def evaluate_candles(self, series: typing.Dict[str, np.ndarray]) -> np.ndarray:
+        """Signals for every candle of the series, use this for backtests."""
+        return self.evaluate(EvalContext(series))
+
+    def evaluate_many(self, series_list: typing.List[typing.Dict[str, np.ndarray]], index: int = -2) -> np.ndarray:
+        """Evaluates many symbols in one vectorized pass and returns the signal of each one at the candle index
+        (the last closed candle by default)."""
+        stacked = {field: indicators.stack_series([series[field] for series in series_list]) for field in SERIES}
+        return self.evaluate(EvalContext(stacked))[:, index]
+
+
+# compiled rules are cached by text so the same rule used by several strategies is only parsed once
+_compiled_rules: typing.Dict[str, CompiledRule] = dict()
+
+
+def compile_rule(text: str) -> CompiledRule:
+    if text not in _compiled_rules:
+        _compiled_rules[text] = CompiledRule(text)
+    return _compiled_rules[text]
@@ -0,0 +1,285 @@
+from models import *
+from interfaces.logging_component import logger
+import json
+import mmap
+import numpy as np
+import os
+from strategies import STRATEGY_TYPES
+import threading
+import time
+import typing
+if typing.TYPE_CHECKING:
+    from coinbase import CoinbaseClient
+    from strategies import Strategy
+
+# File layout: MAGIC, the length of the json header as a little endian uint64, the json header, then the numpy blocks
+# the header points to (offset, dtype, shape), each aligned on BLOCK_ALIGN bytes so they can be viewed in place from a
+# memory map without any copy or parsing.
+MAGIC = b'CBSNAP01'
+BLOCK_ALIGN = 64
+
+CANDLE_DTYPE = np.dtype([('timestamp', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8'),
+                         ('volume', '<f8')])
+
+
+def config_key(config: typing.Dict) -> typing.List:
+    """The parameters of a strategy config with their real types, '1' from the strategy editor and 1.0 from the
+    database give the same key."""
+    strategy_class = STRATEGY_TYPES[config['strategy_type']]
+    return [config['strategy_type'], config['asset'], config['timeframe'], float(config['balance_pct']),
+            float(config['take_profit']), float(config['stop_loss'])] + \
+        [param_type(config[name]) for name, param_type in strategy_class.extra_params]
+
+
+def _trade_to_dict(trade: Trade) -> typing.Dict:
+    return {'time': trade.time, 'asset': trade.asset.symbol, 'strategy': trade.strategy, 'side': trade.side,
+            'entry_price': trade.entry_price, 'status': trade.status, 'pnl': trade.pnl, 'quantity': trade.quantity,
+            'entry_id': trade.entry_id}
+
+
+class Snapshot:
+    """A snapshot file opened with StateSnapshot.load(). The candle and price arrays are views on the memory map."""
+    def __init__(self, header: typing.Dict, buffer: mmap.mmap):
+        self.header = header
+        self.created: float = header['created']
+        self._buffer = buffer
+        # strategy indexes whose saved state was not taken over by a running strategy yet, they are written again by
+        # every save so a strategy not re-activated since the restart keeps its open trades in the snapshot
+        self._unrestored: typing.Set[str] = set(header['strategies'].keys())
+        self._lock = threading.Lock()
+
+    def release(self, strategy_index: int):
+        """The strategy at strategy_index is running, its own state is saved from now on."""
+        with self._lock:
+            self._unrestored.discard(str(strategy_index))
+
+    def remove(self, strategy_index: int):
+        """Drops the saved state of a deleted strategy, the strategies after it move down one index like in
+        StrategyEditor.delete_strategy."""
+        with self._lock:
+            strategies = dict()
+            unrestored = set()
+            for key, state in self.header['strategies'].items():
+                index = int(key)
+                if index == strategy_index:
+                    continue
+                new_key = str(index - 1 if index > strategy_index else index)
+                strategies[new_key] = state
+                if key in self._unrestored:
+                    unrestored.add(new_key)
+            self.header['strategies'] = strategies
+            self._unrestored = unrestored
+
+    def unrestored(self) -> typing.List[typing.Tuple[str, typing.Dict]]:
+        with self._lock:
+            return [(key, self.header['strategies'][key]) for key in sorted(self._unrestored)]
+
+    def _block(self, block: typing.Dict) -> np.ndarray:
+        return np.ndarray(tuple(block['shape']), dtype=np.dtype(block['dtype']), buffer=self._buffer,
+                          offset=block['offset'])
+
+    def strategy_state(self, strategy_index: int, config: typing.Dict) -> typing.Optional[typing.Dict]:
+        """Saved state of the strategy at strategy_index, None if there is none or if its parameters changed since."""
+        state = self.header['strategies'].get(str(strategy_index))
+        if state is None or state['config'] != config_key(config):
+            return None
+        return state
+
+    def candles(self, state: typing.Dict) -> np.ndarray:
+        return self._block(state['candles'])
+
+    def indicators(self) -> typing.List[typing.Tuple[typing.Tuple, typing.Any, typing.Dict[str, np.ndarray]]]:
+        """(key, stamp, outputs) of every indicator value cached when the snapshot was taken, the int stamps of the
+        snapshots written before the stamp was a tuple never match and these values are recomputed."""
+        return [((entry['key'][0], entry['key'][1], entry['key'][2], tuple(entry['key'][3])),
+                 tuple(entry['stamp']) if isinstance(entry['stamp'], list) else entry['stamp'],
+                 {name: np.array(self._block(block)) for name, block in entry['outputs'].items()})
+                for entry in self.header['indicators']]
+
+    def prices(self) -> typing.Tuple[typing.List[str], np.ndarray]:
+        return self.header['prices']['symbols'], self._block(self.header['prices']['table'])
+
+
+class StateSnapshot:
+    """Saves the runtime state the workspace database doesn't hold (candle buffers, cached indicator values, open
+    trades, pending orders and the price table) so a restart is back to trading without downloading 300 candles per
+    strategy. See switch_strategy for the restore of a strategy."""
+    def __init__(self, path: str = 'snapshot.bin'):
+        self.path = path
+        # the snapshot read by load(), its strategies not restored yet are carried over to the next saves
+        self.loaded: typing.Optional[Snapshot] = None
+
+    def save(self, coinbase: "CoinbaseClient", trade_strategies: typing.Dict[int, typing.Dict]):
+        blocks: typing.List[np.ndarray] = []
+        header = {'created': time.time(), 'strategies': dict(), 'indicators': [], 'prices': dict()}
+
+        def add_block(array: np.ndarray) -> typing.Dict:
+            blocks.append(np.ascontiguousarray(array))
+            # offsets are filled in once the header size is known
+            return {'index': len(blocks) - 1, 'dtype': array.dtype.str if array.dtype.names is None else
+                    array.dtype.descr, 'shape': list(array.shape)}
+
+        for strategy_index, strategy in list(coinbase.strategies.items()):
+            if strategy_index not in trade_strategies:
+                continue
+
+            with strategy._candle_lock:
+                candles = np.array([(candle.timestamp, candle.open, candle.high, candle.low, candle.close,
+                                     candle.volume) for candle in strategy.candles], dtype=CANDLE_DTYPE)
+            trades = [trade for trade in strategy.trades if trade.status == 'open']
+
+            header['strategies'][str(strategy_index)] = {
+                'config': config_key(trade_strategies[strategy_index]), 'candles': add_block(candles),
+                'trades': [_trade_to_dict(trade) for trade in trades],
+                # entry orders not filled yet, their status polling is restarted on restore
+                'pending_orders': [trade.entry_id for trade in trades if trade.entry_price is None]}
+
+        if self.loaded is not None:
+            for key, state in self.loaded.unrestored():
+                if key not in header['strategies']:
+                    header['strategies'][key] = dict(state, candles=add_block(np.array(self.loaded.candles(state))))
+
+        for key, stamp, outputs in coinbase.indicators.cached():
+            header['indicators'].append({'key': list(key[:3]) + [list(key[3])], 'stamp': list(stamp),
+                                         'outputs': {name: add_block(np.asarray(values, dtype='<f8'))
+                                                     for name, values in outputs.items()}})
+
+        header['prices'] = {'symbols': coinbase.prices.symbols,
+                            'table': add_block(coinbase.prices.snapshot_all())}
+
+        self._write(header, blocks)
+
+    def _write(self, header: typing.Dict, blocks: typing.List[np.ndarray]):
+        # the header size depends on the offsets written in it, reserve room for them then place the blocks after it
+        block_nodes = self._block_nodes(header)
+        for node in block_nodes:
+            node['offset'] = 0
+        # room for offsets of up to 20 digits
+        header_size = len(json.dumps(header).encode()) + 20 * len(block_nodes)
+        offset = self._align(len(MAGIC) + 8 + header_size)
+
+        for node in block_nodes:
+            node['offset'] = offset
+            offset = self._align(offset + blocks[node['index']].nbytes)
+
+        header_bytes = json.dumps(header).encode().ljust(header_size)
+
+        # written next to the file then renamed, a crash while saving leaves the previous snapshot untouched
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(np.uint64(header_size).astype('<u8').tobytes())
+            f.write(header_bytes)
+            for node in block_nodes:
+                f.seek(node['offset'])
+                f.write(blocks[node['index']].tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _align(offset: int) -> int:
+        return (offset + BLOCK_ALIGN - 1) // BLOCK_ALIGN * BLOCK_ALIGN
+
+    def load(self) -> typing.Optional[Snapshot]:
+        """Memory-maps the snapshot file, None if there is none or it is not a valid snapshot."""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < len(MAGIC) + 8:
+            return None
+
+        with open(self.path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if buffer[:len(MAGIC)] != MAGIC:
+            logger.warning(f'{self.path} is not a snapshot file, it is ignored')
+            return None
+
+        header_size = int(np.frombuffer(buffer, dtype='<u8', count=1, offset=len(MAGIC))[0])
+        try:
+            header = json.loads(bytes(buffer[len(MAGIC) + 8:len(MAGIC) + 8 + header_size]))
+        except ValueError as err:
+            logger.warning(f'Snapshot {self.path} is corrupted, it is ignored: {err}')
+            return None
+
+        for node in self._block_nodes(header):
+            if isinstance(node['dtype'], list):
+                # structured dtypes are saved as their descr
+                node['dtype'] = [tuple(field) for field in node['dtype']]
+
+        logger.info(f'Snapshot loaded, taken {time.time() - header["created"]:.0f}s ago')
+        self.loaded = Snapshot(header, buffer)
+        return self.loaded
+
+    @staticmethod
+    def _block_nodes(header: typing.Dict) -> typing.List[typing.Dict]:
+        nodes = [state['candles'] for state in header['strategies'].values()]
+        for entry in header['indicators']:
+            nodes.extend(entry['outputs'].values())
+        nodes.append(header['prices']['table'])
+        return nodes
+
+
+def restore_strategy(strategy: "Strategy", snapshot: Snapshot, state: typing.Dict) -> bool:
+    """Puts the saved candles and open trades back in a new strategy object and downloads the candles since the
+    snapshot. Returns False if the snapshot is too old to be worth it (more than one request of candles missing), the
+    caller then downloads the history as usual."""
+    coinbase = strategy.coinbase
+    saved = snapshot.candles(state)
+    if len(saved) < 2:
+        return False
+
+    # the candle in progress when the snapshot was taken is downloaded again with the tail
+    last_closed = int(saved['timestamp'][-2])
+    now = int(time.time())
+    if (now - last_closed) // strategy.tf_equiv > 300:
+        return False
+
+    tail = coinbase.get_candles_range(strategy.asset.symbol, strategy.timeframe, last_closed + strategy.tf_equiv, now)
+    if tail is None:
+        return False
+
+    candles = [Candle(dict(zip(('start', 'open', 'high', 'low', 'close', 'volume'), row)))
+               for row in saved[:-1].tolist()]
+    if len(tail) > 0:
+        candles.extend(sorted(tail, key=lambda candle: candle.timestamp))
+    else:
+        # nothing traded since, the saved candle is the last one. The candle clock adds the empty candles up to now
+        candles.append(Candle({'start': saved[-1]['timestamp'], 'open': saved[-1]['open'], 'high': saved[-1]['high'],
+                               'low': saved[-1]['low'], 'close': saved[-1]['close'], 'volume': saved[-1]['volume']}))
+
+    with strategy._candle_lock:
+        strategy.candles = candles
+
+    for trade_info in state['trades']:
+        trade_info = dict(trade_info, asset=strategy.asset)
+        trade = Trade(trade_info)
+        strategy.trades.append(trade)
+        strategy.ongoing_position = True
+
+        notional = trade.quantity if trade.side == 'long' else trade.quantity * (trade.entry_price or
+                                                                                 candles[-1].close)
+        coinbase.risk.restore_trade(trade, strategy, notional)
+        if trade.entry_price is not None:
+            coinbase.triggers.arm(trade, strategy)
+
+    for order_id in state['pending_orders']:
+        strategy._check_order_status(order_id)
+
+    logger.info(f'{strategy.asset.symbol} {strategy.timeframe} restored from the snapshot with {len(tail)} new '
+                f'candles and {len(state["trades"])} open trades')
+    return True
+
+
+def restore_prices(coinbase: "CoinbaseClient", snapshot: Snapshot):
+    """Fills the price table with the last prices seen before the restart, until the websocket sends fresh ones."""
+    symbols, table = snapshot.prices()
+    for symbol, row in zip(symbols, table):
+        if row['seq'] != 0 and symbol not in coinbase.prices:
+            coinbase.prices.set_quote(symbol, bid=float(row['bid']), ask=float(row['ask']), last=float(row['last']),
+                                      timestamp=float(row['timestamp']))
+
+
+def restore_indicators(coinbase: "CoinbaseClient", snapshot: Snapshot):
+    """Puts back the cached indicator values of the restored strategies, they are used as long as no candle closed
+    since the snapshot."""
+    for key, stamp, outputs in snapshot.indicators():
+        coinbase.indicators.restore(key, stamp, outputs)
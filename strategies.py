@@ -1,7 +1,12 @@
 from models import *
 from typing import *
+from indicators import candle_arrays
 from interfaces.logging_component import logger
-import pandas as pd
+from order_gateway import PRIORITY_STOP_LOSS, PRIORITY_TAKE_PROFIT
+import numpy as np
+from signal_language import EvalContext, SignalProgram
+from triggers import DOWN, UP
+import threading
 import time
 from threading import Timer
 if TYPE_CHECKING:
@@ -10,6 +15,46 @@ if TYPE_CHECKING:
 TF_EQUIV = {'ONE_MINUTE': 60, 'FIVE_MINUTE': 300, 'FIFTEEN_MINUTE': 900, 'THIRTY_MINUTE': 1800, 'ONE_HOUR': 3600,
             'TWO_HOUR': 7200, 'SIX_HOUR': 21600, 'ONE_DAY': 86400}
 
+# a failed exit order is retried after EXIT_RETRY_DELAY * 2 ** (failures - 1) seconds, at most EXIT_RETRY_MAX_DELAY
+EXIT_RETRY_DELAY = 0.5
+EXIT_RETRY_MAX_DELAY = 30.0
+
+# strategy type name ('Technical', 'Breakout', ...) -> strategy class, filled by the register_strategy decorator. The
+# strategy editor and the workspace saving only go through this dict, so a new strategy type only has to be decorated
+STRATEGY_TYPES: Dict[str, Type["Strategy"]] = dict()
+
+
+def register_strategy(strategy_class):
+    """Class decorator that makes a strategy available by its strategy_type. The class lists the parameters it takes
+    after the common ones (asset, timeframe, balance_pct, take_profit, stop_loss) in extra_params, in constructor
+    order, as (name, type) tuples."""
+    STRATEGY_TYPES[strategy_class.strategy_type] = strategy_class
+    return strategy_class
+
+
+def create_strategy(coinbase: "CoinbaseClient", config: Dict) -> "Strategy":
+    """Builds a strategy object from a trade_strategies entry of the strategy editor (or a row of the strategies table
+    with its extra_params unpacked). Raises a RuleSyntaxError if the rules of a Rule strategy are not valid."""
+    strategy_class = STRATEGY_TYPES[config['strategy_type']]
+    extra_params = [param_type(config[name]) for name, param_type in strategy_class.extra_params]
+
+    return strategy_class(coinbase, coinbase.assets[config['asset']], config['timeframe'], float(config['balance_pct']),
+                          float(config['take_profit']), float(config['stop_loss']), *extra_params)
+
+
+def evaluate_signals(strategies: List["Strategy"]) -> Dict["Strategy", int]:
+    """Signal of every strategy on its last closed candle. Strategies of the same type are handed together to their
+    class's batch_signals so the indicators of all of them are computed in one vectorized pass."""
+    by_type: Dict[type, List["Strategy"]] = dict()
+    for strategy in strategies:
+        by_type.setdefault(type(strategy), []).append(strategy)
+
+    signals = dict()
+    for strategy_class, group in by_type.items():
+        signals.update(zip(group, strategy_class.batch_signals(group)))
+
+    return signals
+
 
 class Strategy:
     def __init__(self, coinbase: "CoinbaseClient", asset: Asset, timeframe: str, balance_pct: float, take_profit: float,
@@ -29,16 +74,43 @@ class Strategy:
         self.logger = logger
 
         self.candles: List[Candle] = []
+        # the websocket thread (parse_trade) and the candle clock thread (close_candle) both add candles
+        self._candle_lock = threading.RLock()
 
         self.trades: List[Trade] = []
         self.logs = []
 
+        # keys of the shared indicator values this strategy reads (see IndicatorService)
+        self._indicator_keys = []
+        # entry_id -> exit orders of the trade that failed in a row, sets the delay before its triggers are re-armed
+        self._exit_failures: Dict[str, int] = dict()
+
     def _add_log(self, msg: str):
         logger.info(msg)
         self.logs.append({'log': msg, 'displayed': False})
 
+    def subscribe_indicator(self, indicator: str, *params):
+        key = self.coinbase.indicators.subscribe(self.asset.symbol, self.timeframe, indicator, *params)
+        self._indicator_keys.append(key)
+        return key
+
+    def indicator(self, key) -> Dict[str, float]:
+        """Outputs of a subscribed indicator on the last closed candle, computed once per candle for all the strategies
+        of the client that use it."""
+        return self.coinbase.indicators.latest(key, self)
+
+    def stop(self):
+        """Releases the indicator values of the strategy, called when it is deactivated."""
+        for key in self._indicator_keys:
+            self.coinbase.indicators.unsubscribe(key)
+        self._indicator_keys = []
+
     def parse_trade(self, price: float, size: float, timestamp: int):
         """Takes incoming trade data from the market_trades websocket channel and updates the self.candles list."""
+        with self._candle_lock:
+            return self._update_candles(price, size, timestamp)
+
+    def _update_candles(self, price: float, size: float, timestamp: int):
         timestamp_diff = int(time.time()) - timestamp
         if timestamp_diff >= 2000:
             # if you're seeing this message often, something in check_trades is slowing down the websocket updates
@@ -47,8 +119,20 @@ class Strategy:
 
         last_candle = self.candles[-1]
 
+        # late trade: the candle clock already opened the next candle when this trade arrived, it belongs to the
+        # previous one
+        if timestamp < last_candle.timestamp and len(self.candles) > 1 and \
+                timestamp >= self.candles[-2].timestamp:
+            previous_candle = self.candles[-2]
+            previous_candle.close = price
+            previous_candle.volume += size
+            previous_candle.high = max(previous_candle.high, price)
+            previous_candle.low = min(previous_candle.low, price)
+
+            return 'same_candle'
+
         # same candle: if timestamp of trade is not greater than the timestamp of last_candle
-        if timestamp < last_candle.timestamp + self.tf_equiv:
+        elif timestamp < last_candle.timestamp + self.tf_equiv:
 
             last_candle.close = price
             last_candle.volume += size
@@ -58,13 +142,7 @@ class Strategy:
             elif price < last_candle.low:
                 last_candle.low = price
 
-            # check take profit and stop loss
-
-            for trade in self.trades:
-                if trade.status == 'open' and trade.entry_price is not None:
-                    self._check_tp_sl(trade)
-                    logger.info(f'Trade {trade.entry_id} - side: {trade.side}, entry price: {trade.entry_price}, '
-                                f'current price: {price}, PNL: {trade.pnl}')
+            # take profit and stop loss are checked by the client's TriggerIndex on every trade
 
             return 'same_candle'
 
@@ -99,15 +177,120 @@ class Strategy:
             logger.info(f'New candle for {self.asset.symbol} on {self.timeframe} timeframe')
             return 'new_candle'
 
+    def close_candle(self, boundary: int) -> bool:
+        """Called by the candle clock exactly when a candle of this timeframe ends, opens the candle starting at
+        boundary. Returns False if a trade of the new candle already arrived and opened it."""
+        with self._candle_lock:
+            if len(self.candles) == 0 or self.candles[-1].timestamp >= boundary:
+                return False
+
+            last_candle = self.candles[-1]
+            # no trade at all during the last candle(s): fill them with the last close like parse_trade does
+            while last_candle.timestamp + self.tf_equiv < boundary:
+                candle_info = {'start': last_candle.timestamp + self.tf_equiv, 'open': last_candle.close,
+                               'high': last_candle.close, 'low': last_candle.close, 'close': last_candle.close,
+                               'volume': 0}
+                last_candle = Candle(candle_info)
+                self.candles.append(last_candle)
+
+            candle_info = {'start': boundary, 'open': last_candle.close, 'high': last_candle.close,
+                           'low': last_candle.close, 'close': last_candle.close, 'volume': 0}
+            self.candles.append(Candle(candle_info))
+
+            return True
+
+    def resync(self, gap_start: float):
+        """Downloads the candles between gap_start and the current candle after the feed was interrupted and merges
+        them in place of the synthetic or stale candles built while the feed was down."""
+        with self._candle_lock:
+            if len(self.candles) == 0:
+                return
+            end = self.candles[-1].timestamp
+
+        start = int(gap_start) - int(gap_start) % self.tf_equiv
+        if start >= end:
+            return
+
+        candles = []
+        # the candles endpoint returns at most 300 candles per request
+        for page_start in range(start, end, 300 * self.tf_equiv):
+            page = self.coinbase.get_candles_range(self.asset.symbol, self.timeframe, page_start,
+                                                   min(page_start + 300 * self.tf_equiv, end))
+            if page is None:
+                logger.warning(f'Resync of {self.asset.symbol} {self.timeframe} failed')
+                return
+            candles.extend(page)
+
+        merged = self.merge_candles(candles)
+        logger.info(f'Resync of {self.asset.symbol} {self.timeframe}: {merged} candles replaced or added')
+
+    def merge_candles(self, candles: List[Candle]) -> int:
+        """Puts the closed candles in self.candles, replacing the ones with the same timestamp. The candle in progress
+        is left alone since the live trades keep updating it. Returns the number of candles merged."""
+        with self._candle_lock:
+            if len(self.candles) == 0:
+                return 0
+
+            current_start = self.candles[-1].timestamp
+            positions = {candle.timestamp: i for i, candle in enumerate(self.candles)}
+            merged = 0
+            inserted = False
+
+            for candle in candles:
+                if candle.timestamp >= current_start:
+                    continue
+                if candle.timestamp in positions:
+                    self.candles[positions[candle.timestamp]] = candle
+                else:
+                    self.candles.append(candle)
+                    inserted = True
+                merged += 1
+
+            if inserted:
+                self.candles.sort(key=lambda c: c.timestamp)
+
+            if merged > 0:
+                self.coinbase.indicators.invalidate(self.asset.symbol, self.timeframe)
+
+            return merged
+
+    @classmethod
+    def batch_signals(cls, strategies: List["Strategy"]) -> List[int]:
+        """Signal of each strategy, in order. Subclasses override it to evaluate all of them at once."""
+        return [strategy._check_signal() for strategy in strategies]
+
+    def candle_series(self) -> Dict[str, np.ndarray]:
+        """Copy of the candles as numpy arrays, safe to use while the websocket keeps adding trades."""
+        with self._candle_lock:
+            return candle_arrays(self.candles)
+
+    def on_signal(self, signal_result: int):
+        """Opens a position for a signal computed outside of check_trade (see evaluate_signals)."""
+        if signal_result in [-1, 1] and not self.ongoing_position:
+            self._open_position(signal_result)
+
+    def update_pnl(self, bid: float, ask: float):
+        """Updates the pnl of the open trades with the latest prices."""
+        # THIS CALCULATION DOES NOT TAKE INTO ACCOUNT FEES FOR TRANSACTIONS
+        for trade in self.trades:
+            if trade.status == 'open' and trade.entry_price is not None:
+                if trade.side == 'long':
+                    trade.pnl = (bid - trade.entry_price) * (trade.quantity / trade.entry_price)
+                elif trade.side == 'short':
+                    trade.pnl = (trade.entry_price - ask) * trade.quantity
+
     def _check_order_status(self, order_id):
 
         order_status = self.coinbase.get_order_status(order_id)
         if order_status is not None:
             logger.info(f'Order status:  {order_status.status}')
-            if order_status == 'FILLED':
+            if order_status.status == 'FILLED':
                 for trade in self.trades:
                     if trade.entry_id == order_id:
                         trade.entry_price = order_status.avg_price
+                        if trade.side == 'short':
+                            self.coinbase.risk.update_notional(trade, trade.quantity * trade.entry_price)
+                        self.coinbase.triggers.arm(trade, self)
                         break
                 return
 
@@ -123,12 +306,20 @@ class Strategy:
             logger.warning('trade_size is None')
             return
 
+        # BUY trade_size is already in quote currency, SELL trade_size is in base currency
+        notional = trade_size if order_side == 'BUY' else trade_size * self.candles[-1].close
+        if not self.coinbase.risk.reserve(self.asset.symbol, self, notional):
+            return
+
         self._add_log(f'{position_side} signal on {self.asset.symbol} for {self.timeframe}')
 
         # if limit order will need to change
         order_status = self.coinbase.place_order(self.asset, order_side, 'MARKET', trade_size)
 
-        if order_status is not None:
+        if order_status is None:
+            self.coinbase.risk.release(self.asset.symbol, self, notional)
+
+        else:
             self._add_log(f'{order_side} order placed | Status: {order_status.status}')
             self.ongoing_position = True
             avg_fill_price = None
@@ -143,53 +334,97 @@ class Strategy:
                                'strategy': self.strat_name, 'side': position_side, 'status': 'open', 'pnl': 0,
                                'quantity': trade_size, 'entry_id': order_status.order_id})
             self.trades.append(new_trade)
+            self.coinbase.risk.register_trade(new_trade, self, notional)
+            if new_trade.entry_price is not None:
+                # same as _check_order_status: the notional of a short was estimated from the last close
+                if new_trade.side == 'short':
+                    self.coinbase.risk.update_notional(new_trade, new_trade.quantity * new_trade.entry_price)
+                self.coinbase.triggers.arm(new_trade, self)
+
+    def exit_triggers(self, trade: Trade) -> List[Tuple[str, float, str]]:
+        """Take profit and stop loss levels of a filled trade as (kind, price, direction) tuples, direction is UP if
+        the level fires when the price goes to or above it and DOWN if it fires at or below. They are armed in the
+        client's TriggerIndex, which checks them on every trade of the feed."""
+        if trade.side == 'long':
+            return [('stop_loss', trade.entry_price * (1 - (self.stop_loss / 100)), DOWN),
+                    ('take_profit', trade.entry_price * (1 + (self.take_profit / 100)), UP)]
 
-    def _check_tp_sl(self, trade: Trade):
-        tp_triggered = False
-        sl_triggered = False
+        # I've disabled my TP on since I can't actually short, if I have a trade open and price reverses then a
+        # long signal should kick in on breakout strategy, but would this be true for all strategies?
+        # ('take_profit', trade.entry_price * (1 - (self.take_profit / 100)), DOWN)
+        return [('stop_loss', trade.entry_price * (1 + (self.stop_loss / 100)), UP)]
 
-        price = self.candles[-1].close
+    def on_trigger(self, trade: Trade, kind: str):
+        """Sends the exit order of a trade whose take profit or stop loss level was crossed."""
+        if trade.status != 'open':
+            return
 
-        if trade.side == 'long':
-            if price <= float(trade.entry_price) * (1 - (float(self.stop_loss) / 100)):
-                sl_triggered = True
-            elif price >= float(trade.entry_price) * (1 + (float(self.take_profit) / 100)):
-                tp_triggered = True
-
-        elif trade.side == 'short':
-            if price >= float(trade.entry_price) * (1 + (float(self.stop_loss) / 100)):
-                sl_triggered = True
-            # I've disabled my TP on since I can't actually short, if I have a trade open and price reverses then a
-            # long signal should kick in on breakout strategy, but would this be true for all strategies?
-            # elif price <= float(trade.entry_price) * (1 - (float(self.take_profit) / 100)):
-            #     tp_triggered = True
-
-        if tp_triggered or sl_triggered:
-            logger.info(f'{"Stop loss" if sl_triggered else "Take profit"} for {self.asset.symbol} on {self.timeframe}')
-            # so here we need to figure out if we want to actually buy here or not for short's. Actually I think we do
-            # once we buy we keep the same trade going and it will just sell when te trade goes the other way, correct??
-            order_side = 'SELL' if trade.side == 'long' else 'BUY'
-
-            if order_side == 'BUY':
-                # trade is short and the initial trade.quantity is in base asset and needs to be converted to dollars
-                trade.quantity = str(format(float(trade.quantity) *
-                                            float(self.coinbase.prices[self.asset.symbol]['ask']), '.2f'))
+        logger.info(f'{"Stop loss" if kind == "stop_loss" else "Take profit"} for {self.asset.symbol} on '
+                    f'{self.timeframe}')
+        try:
+            order_side, quantity = self.exit_order_params(trade)
+        except ValueError as err:
+            logger.error(f'Exit order on {self.asset.symbol} on {self.timeframe} not sent: {err}')
+            order_status = None
+        else:
+            order_status = self.coinbase.place_order(self.asset, order_side, 'MARKET', quantity,
+                                                     priority=PRIORITY_STOP_LOSS if kind == 'stop_loss' else
+                                                     PRIORITY_TAKE_PROFIT)
 
-            else:
-                # trade is long and initial trade.quantity is in dollars and needs to be converted to base asset
-                trade.quantity = str(format(float(trade.quantity) *
-                                            (1 / float(self.coinbase.prices[self.asset.symbol]['ask'])),
-                                            f'.{self.asset.base_increment}f'))
+        if order_status is not None:
+            logger.info(f'Exit order on {self.asset.symbol} on {self.timeframe} successfully placed')
+            self.close_trade(trade)
+        else:
+            # armed again after a backoff so the next trade past the level retries the exit, without sending an order
+            # on every message of the feed while the exchange is rejecting them
+            failures = self._exit_failures.get(trade.entry_id, 0) + 1
+            self._exit_failures[trade.entry_id] = failures
+            delay = min(EXIT_RETRY_MAX_DELAY, EXIT_RETRY_DELAY * 2 ** (failures - 1))
+            logger.error(f'Exit order on {self.asset.symbol} on {self.timeframe} failed {failures} time(s), retrying '
+                         f'in {delay:.1f}s')
+            t = Timer(delay, lambda: self._rearm_exit(trade))
+            t.daemon = True
+            t.start()
+
+    def _rearm_exit(self, trade: Trade):
+        if trade.status == 'open':
+            self.coinbase.triggers.arm(trade, self)
+
+    def exit_order_params(self, trade: Trade) -> Tuple[str, float]:
+        """Returns the side and quantity of the MARKET order that closes the trade, place_order rounds the quantity to
+        the increments of the asset. Raises a ValueError if the feed has no ask price for the asset yet."""
+        # so here we need to figure out if we want to actually buy here or not for short's. Actually I think we do
+        # once we buy we keep the same trade going and it will just sell when te trade goes the other way, correct??
+        order_side = 'SELL' if trade.side == 'long' else 'BUY'
+
+        quote = self.coinbase.prices.snapshot(self.asset.symbol)
+        if quote is None or not quote['ask'] > 0:
+            raise ValueError(f'no ask price for {self.asset.symbol} to size the exit order of trade {trade.entry_id}')
+
+        if order_side == 'BUY':
+            # trade is short and the initial trade.quantity is in base asset and needs to be converted to dollars
+            quantity = trade.quantity * quote['ask']
 
-            order_status = self.coinbase.place_order(self.asset, order_side, 'MARKET', trade.quantity)
+        else:
+            # trade is long and initial trade.quantity is in dollars and needs to be converted to base asset
+            quantity = trade.quantity / quote['ask']
 
-            if order_status is not None:
-                logger.info(f'Exit order on {self.asset.symbol} on {self.timeframe} successfully placed')
-                trade.status = 'closed'
-                self.ongoing_position = False
+        return order_side, quantity
+
+    def close_trade(self, trade: Trade):
+        """Marks the trade as closed once its exit order went through."""
+        trade.status = 'closed'
+        self.ongoing_position = False
+        self._exit_failures.pop(trade.entry_id, None)
+        self.coinbase.triggers.disarm(trade)
+        self.coinbase.risk.close(trade)
 
 
+@register_strategy
 class TechnicalStrategy(Strategy):
+    strategy_type = 'Technical'
+    extra_params = [('rsi_length', int), ('ema_fast', int), ('ema_slow', int), ('ema_signal', int)]
+
     def __init__(self, coinbase, asset: Asset, timeframe: str, balance_pct: float, take_profit: float, stop_loss: float,
                  rsi_length: int, ema_fast: int, ema_slow: int, ema_signal: int):
         super().__init__(coinbase, asset, timeframe, balance_pct, take_profit, stop_loss, 'Technical')
@@ -199,46 +434,15 @@ class TechnicalStrategy(Strategy):
         self._ema_slow = ema_slow
         self._ema_signal = ema_signal
 
-    def _rsi(self):
-        close_list = []
-        for candle in self.candles:
-            close_list.append(candle.close)
-
-        closes = pd.Series(close_list)
-        # calculates the difference bw the close price of each candle over the time period
-        delta = closes.diff().dropna()
-        # create two copies of the delta list to specify if the delta is positive or negative
-        up, down = delta.copy(), delta.copy()
-        # for up we set the losses from one candle to the next to 0, only positive numbers in the series
-        up[up < 0] = 0
-        # for down we set the gains from one candle to the next to 0, only negative numbers in teh series
-        down[down > 0] = 0
-        # he uses com or center of mass to highlight there are multiple ways to calculate an exponential moving average
-        avg_gain = up.ewm(com=(self._rsi_length - 1), min_periods=self._rsi_length).mean()
-        avg_loss = down.abs().ewm(com=(self._rsi_length - 1), min_periods=self._rsi_length).mean()
-
-        rs = avg_gain / avg_loss
+        self._rsi_key = self.subscribe_indicator('rsi', rsi_length)
+        self._macd_key = self.subscribe_indicator('macd', ema_fast, ema_slow, ema_signal)
 
-        rsi = 100 - (100 / (1 + rs))
-        rsi = rsi.round(2)
-
-        return rsi.iloc[-2]
+    def _rsi(self) -> float:
+        return self.indicator(self._rsi_key)['rsi']
 
     def _macd(self) -> Tuple[float, float]:
-
-        close_list = []
-        for candle in self.candles:
-            close_list.append(candle.close)
-
-        closes = pd.Series(close_list)
-
-        ema_fast = closes.ewm(span=self._ema_fast).mean()
-        ema_slow = closes.ewm(span=self._ema_slow).mean()
-
-        macd_line = ema_fast - ema_slow
-        macd_signal = macd_line.ewm(span=self._ema_signal).mean()
-
-        return macd_line.iloc[-2], macd_signal.iloc[-2]
+        macd = self.indicator(self._macd_key)
+        return macd['line'], macd['signal']
 
     def _check_signal(self):
         macd_line, macd_signal = self._macd()
@@ -251,6 +455,25 @@ class TechnicalStrategy(Strategy):
         else:
             return 0
 
+    @classmethod
+    def batch_signals(cls, strategies: List["TechnicalStrategy"]) -> List[int]:
+        # the values come from the IndicatorService like in _check_signal, the ones not cached yet are computed in one
+        # stacked pass with a row per (symbol, timeframe)
+        service = strategies[0].coinbase.indicators
+        rsi_outputs = service.get_many([(strategy._rsi_key, strategy) for strategy in strategies])
+        macd_outputs = service.get_many([(strategy._macd_key, strategy) for strategy in strategies])
+
+        def last_closed(outputs: Dict[str, np.ndarray], name: str) -> float:
+            return float(outputs[name][-2]) if name in outputs and len(outputs[name]) > 1 else np.nan
+
+        rsi = np.array([last_closed(outputs, 'rsi') for outputs in rsi_outputs])
+        macd_line = np.array([last_closed(outputs, 'line') for outputs in macd_outputs])
+        macd_signal = np.array([last_closed(outputs, 'signal') for outputs in macd_outputs])
+
+        signals = np.where((rsi < 30) & (macd_line > macd_signal), 1,
+                           np.where((rsi > 70) & (macd_line < macd_signal), -1, 0))
+        return [int(signal_result) for signal_result in signals]
+
     def check_trade(self, tick_type: str):
         """Checks the websocket feed for info to see if our parameters have been met to enter a trade."""
         if tick_type == 'new_candle' and not self.ongoing_position:
@@ -261,7 +484,11 @@ class TechnicalStrategy(Strategy):
         return
 
 
+@register_strategy
 class BreakoutStrategy(Strategy):
+    strategy_type = 'Breakout'
+    extra_params = [('min_volume', int)]
+
     def __init__(self, coinbase, asset: Asset, timeframe: str, balance_pct: float, take_profit: float, stop_loss: float,
                  min_volume):
         super().__init__(coinbase, asset, timeframe, balance_pct, take_profit, stop_loss, 'Breakout')
@@ -269,7 +496,6 @@ class BreakoutStrategy(Strategy):
         self.min_volume = min_volume
 
     def _check_signal(self) -> int:
-        # HERE WE'LL ADD SOME SORT OF RSI PARAMETERS AS WELL
         if self.candles[-1].close > self.candles[-2].high and self.candles[-1].volume > self.min_volume:
             return 1
         elif self.candles[-1].close < self.candles[-2].low and self.candles[-1].volume > self.min_volume:
@@ -277,6 +503,28 @@ class BreakoutStrategy(Strategy):
         else:
             return 0
 
+    @classmethod
+    def batch_signals(cls, strategies: List["BreakoutStrategy"]) -> List[int]:
+        # called by the candle clock once the empty candle of the new period was added: the breakout candle is the one
+        # that just closed ([-2]) and it breaks out of the one before it ([-3])
+        series = [strategy.candle_series() for strategy in strategies]
+        ready = np.array([len(candles['close']) >= 3 for candles in series])
+        if not np.any(ready):
+            return [0] * len(strategies)
+
+        def closed(field: str, index: int) -> np.ndarray:
+            return np.array([candles[field][index] if len(candles[field]) >= 3 else np.nan for candles in series])
+
+        close = closed('close', -2)
+        volume = closed('volume', -2)
+        previous_high = closed('high', -3)
+        previous_low = closed('low', -3)
+        min_volume = np.array([strategy.min_volume for strategy in strategies])
+
+        signals = np.where(ready & (close > previous_high) & (volume > min_volume), 1,
+                           np.where(ready & (close < previous_low) & (volume > min_volume), -1, 0))
+        return [int(signal_result) for signal_result in signals]
+
     def check_trade(self, tick_type: str):
         """Checks the websocket feed for signs of parameters being met to enter a trade."""
         if not self.ongoing_position:
@@ -284,3 +532,48 @@ class BreakoutStrategy(Strategy):
 
             if signal_result in [-1, 1]:
                 self._open_position(signal_result)
+
+
+@register_strategy
+class RuleStrategy(Strategy):
+    """Strategy described by rules of the signal language (see signal_language.py), for example
+    long_rule='rsi(14) < 30 and macd(12, 26, 9).cross_up', short_rule='rsi(14) > 70 and macd(12, 26, 9).cross_down'.
+    An empty rule means that side never trades."""
+    strategy_type = 'Rule'
+    extra_params = [('long_rule', str), ('short_rule', str)]
+
+    def __init__(self, coinbase, asset: Asset, timeframe: str, balance_pct: float, take_profit: float, stop_loss: float,
+                 long_rule: str, short_rule: str):
+        super().__init__(coinbase, asset, timeframe, balance_pct, take_profit, stop_loss, 'Rule')
+
+        # raises a RuleSyntaxError right away if one of the rules is not valid
+        self.program = SignalProgram(long_rule, short_rule)
+
+    def _check_signal(self) -> int:
+        # same as TechnicalStrategy the signal is read on the last closed candle, candles[-1] just opened
+        signals = self.program.evaluate(EvalContext(candle_arrays(self.candles)))
+        return int(signals[-2])
+
+    @classmethod
+    def batch_signals(cls, strategies: List["RuleStrategy"]) -> List[int]:
+        # compiled rules are cached by text, strategies with the same rules share one evaluation
+        groups: Dict[Tuple[int, int], List[int]] = dict()
+        for i, strategy in enumerate(strategies):
+            groups.setdefault((id(strategy.program.long_rule), id(strategy.program.short_rule)), []).append(i)
+
+        signals = [0] * len(strategies)
+        for members in groups.values():
+            program = strategies[members[0]].program
+            group_signals = program.evaluate_many([strategies[i].candle_series() for i in members])
+            for i, signal_result in zip(members, group_signals):
+                signals[i] = int(signal_result)
+
+        return signals
+
+    def check_trade(self, tick_type: str):
+        """Evaluates the rules each time a candle closes."""
+        if tick_type == 'new_candle' and not self.ongoing_position:
+            signal_result = self._check_signal()
+
+            if signal_result in [-1, 1]:
+                self._open_position(signal_result)
@@ -0,0 +1,261 @@
+from models import *
+from interfaces.logging_component import logger
+import numpy as np
+import os
+from strategies import TF_EQUIV
+import threading
+import time
+import typing
+
+# one file per column, per symbol and per UTC day: <directory>/<symbol>/<YYYY-MM-DD>/<column>.bin
+# trade_id is -1 for trades appended without one (and for the days written before the column existed)
+TAPE_COLUMNS = {'ts': np.float64, 'price': np.float64, 'size': np.float64, 'side': np.int8, 'trade_id': np.int64}
+SIDES = {'BUY': 1, 'SELL': -1}
+# Coinbase trade ids increase by one per trade of a product, the ids of the last RECENT_TRADE_IDS trades of a symbol are
+# remembered to recognize the trades the snapshot of every (re)connection sends again
+RECENT_TRADE_IDS = 1000
+
+
+class TradeTape:
+    """Append-only columnar archive of every trade of the market_trades channel. Trades are buffered in memory and
+    appended to the column files in sorted batches, queries memory-map the files so slicing a day is zero-copy and all
+    the analytics run vectorized over the columns."""
+    def __init__(self, directory: str = 'tape', flush_size: int = 1000, flush_interval: float = 5.0):
+        self.directory = directory
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+
+        # (symbol, day) -> list of (ts, price, size, side, trade_id) not written yet
+        self._buffers: typing.Dict[typing.Tuple[str, int], typing.List[typing.Tuple]] = dict()
+        # (symbol, day) -> ts of the last trade written, an older batch is merged into the day instead of appended
+        self._last_ts: typing.Dict[typing.Tuple[str, int], float] = dict()
+        # symbol -> highest trade id seen and the ids seen above highest - RECENT_TRADE_IDS (written or buffered)
+        self._max_trade_id: typing.Dict[str, int] = dict()
+        self._recent_ids: typing.Dict[str, typing.Set[int]] = dict()
+        self._last_flush = time.time()
+
+        self._lock = threading.Lock()
+
+    def _day_path(self, symbol: str, day: int) -> str:
+        return os.path.join(self.directory, symbol, time.strftime('%Y-%m-%d', time.gmtime(day * 86400)))
+
+    def append(self, symbol: str, ts: float, price: float, size: float, side: str, trade_id: int = None):
+        """Adds a trade, side is 'BUY' or 'SELL' (the taker side as sent by Coinbase). A trade whose trade_id is already
+        on the tape or buffered is ignored."""
+        key = (symbol, int(ts // 86400))
+
+        with self._lock:
+            if trade_id is not None:
+                trade_id = int(trade_id)
+                if not self._remember(symbol, key[1], trade_id):
+                    return
+
+            if key not in self._buffers:
+                self._buffers[key] = []
+            buffer = self._buffers[key]
+            buffer.append((ts, price, size, SIDES.get(side, 0), trade_id if trade_id is not None else -1))
+
+            if len(buffer) >= self.flush_size:
+                self._flush_key(key)
+            elif time.time() - self._last_flush >= self.flush_interval:
+                self._flush_all()
+
+    def _remember(self, symbol: str, day: int, trade_id: int) -> bool:
+        """Records the trade id, False if it was seen already. A trade older than the last RECENT_TRADE_IDS trades of
+        the symbol is taken for a duplicate too, only a replay sends trades that old."""
+        if symbol not in self._max_trade_id:
+            self._max_trade_id[symbol] = -1
+            self._recent_ids[symbol] = set()
+            # the ids of the trades written by a previous run, for the snapshot sent on the first connection
+            for seed_day in [day - 1, day]:
+                for seen_id in self._read_trade_ids(self._day_path(symbol, seed_day), RECENT_TRADE_IDS):
+                    self._add_trade_id(symbol, int(seen_id))
+
+        if trade_id in self._recent_ids[symbol] or trade_id <= self._max_trade_id[symbol] - RECENT_TRADE_IDS:
+            return False
+
+        self._add_trade_id(symbol, trade_id)
+        return True
+
+    def _add_trade_id(self, symbol: str, trade_id: int):
+        if trade_id < 0:
+            return
+        recent = self._recent_ids[symbol]
+        recent.add(trade_id)
+        if trade_id > self._max_trade_id[symbol]:
+            self._max_trade_id[symbol] = trade_id
+            if len(recent) > 2 * RECENT_TRADE_IDS:
+                floor = trade_id - RECENT_TRADE_IDS
+                self._recent_ids[symbol] = {seen_id for seen_id in recent if seen_id > floor}
+
+    @staticmethod
+    def _read_trade_ids(path: str, count: int) -> np.ndarray:
+        ids_path = os.path.join(path, 'trade_id.bin')
+        if not os.path.exists(ids_path):
+            return np.array([], dtype=np.int64)
+        ids = np.memmap(ids_path, dtype=np.int64, mode='r') if os.path.getsize(ids_path) >= 8 else \
+            np.array([], dtype=np.int64)
+        return np.array(ids[-count:])
+
+    def flush(self):
+        """Writes every buffered trade to disk, call it before shutting down."""
+        with self._lock:
+            self._flush_all()
+
+    def _flush_all(self):
+        for key in list(self._buffers.keys()):
+            self._flush_key(key)
+        self._last_flush = time.time()
+
+    def _flush_key(self, key: typing.Tuple[str, int]):
+        buffer = self._buffers.pop(key, [])
+        if len(buffer) == 0:
+            return
+
+        batch = np.array(buffer, dtype=np.float64)
+        batch = batch[np.argsort(batch[:, 0], kind='stable')]
+
+        path = self._day_path(*key)
+        if key not in self._last_ts:
+            self._last_ts[key] = self._read_last_ts(path)
+
+        os.makedirs(path, exist_ok=True)
+        self._add_trade_id_column(path)
+
+        # the repeated trades were dropped by append, a trade older than the end of the file is a late one and the
+        # day is rewritten with it in place so the files stay sorted
+        if batch[0, 0] < self._last_ts[key]:
+            logger.debug(f'Trade tape: {int(np.count_nonzero(batch[:, 0] < self._last_ts[key]))} late trades merged '
+                         f'for {key[0]}')
+            self._merge_day(path, batch)
+        else:
+            for i, (column, dtype) in enumerate(TAPE_COLUMNS.items()):
+                with open(os.path.join(path, column + '.bin'), 'ab') as f:
+                    f.write(batch[:, i].astype(dtype).tobytes())
+
+        self._last_ts[key] = max(self._last_ts[key], float(batch[-1, 0]))
+
+    @staticmethod
+    def _add_trade_id_column(path: str):
+        """Days written before the trade_id column get one filled with -1."""
+        ts_path = os.path.join(path, 'ts.bin')
+        ids_path = os.path.join(path, 'trade_id.bin')
+        if os.path.exists(ts_path) and not os.path.exists(ids_path):
+            with open(ids_path, 'wb') as f:
+                f.write(np.full(os.path.getsize(ts_path) // 8, -1, dtype=np.int64).tobytes())
+
+    def _merge_day(self, path: str, batch: np.ndarray):
+        """Rewrites the column files of the day with the batch sorted in. Every file is written next to the old one
+        then renamed, queries holding a memory map of the old file are not affected."""
+        columns = self._load_day_columns(path)
+        order = np.argsort(np.concatenate([columns['ts'], batch[:, 0]]), kind='stable')
+
+        for i, (column, dtype) in enumerate(TAPE_COLUMNS.items()):
+            merged = np.concatenate([columns[column], batch[:, i].astype(dtype)])[order]
+            tmp_path = os.path.join(path, column + '.bin.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(merged.tobytes())
+            os.replace(tmp_path, os.path.join(path, column + '.bin'))
+
+    @staticmethod
+    def _read_last_ts(path: str) -> float:
+        ts_path = os.path.join(path, 'ts.bin')
+        if not os.path.exists(ts_path) or os.path.getsize(ts_path) < 8:
+            return float('-inf')
+        with open(ts_path, 'rb') as f:
+            f.seek(-8, os.SEEK_END)
+            return float(np.frombuffer(f.read(8), dtype=np.float64)[0])
+
+    def _load_day(self, symbol: str, day: int) -> typing.Optional[typing.Dict[str, np.ndarray]]:
+        return self._load_day_columns(self._day_path(symbol, day))
+
+    @staticmethod
+    def _load_day_columns(path: str) -> typing.Optional[typing.Dict[str, np.ndarray]]:
+        columns = dict()
+
+        for column, dtype in TAPE_COLUMNS.items():
+            file_path = os.path.join(path, column + '.bin')
+            if column == 'trade_id' and not os.path.exists(file_path) and 'ts' in columns:
+                # day written before the trade_id column existed
+                columns[column] = np.full(len(columns['ts']), -1, dtype=np.int64)
+                continue
+            if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+                return None
+            columns[column] = np.memmap(file_path, dtype=dtype, mode='r')
+
+        # a crash between two column writes can leave the columns with different lengths
+        length = min(len(values) for values in columns.values())
+        return {column: values[:length] for column, values in columns.items()}
+
+    def query(self, symbol: str, start: float, end: float) -> typing.Dict[str, np.ndarray]:
+        """Trades with start <= ts < end as one array per column. Within a single day the arrays are views on the
+        memory-mapped files, ranges over several days are concatenated."""
+        self.flush()
+
+        parts = []
+        for day in range(int(start // 86400), int((end - 1e-9) // 86400) + 1):
+            columns = self._load_day(symbol, day)
+            if columns is None:
+                continue
+            first, last = np.searchsorted(columns['ts'], [start, end], side='left')
+            if last > first:
+                parts.append({column: values[first:last] for column, values in columns.items()})
+
+        if len(parts) == 0:
+            return {column: np.array([], dtype=dtype) for column, dtype in TAPE_COLUMNS.items()}
+        elif len(parts) == 1:
+            return parts[0]
+        return {column: np.concatenate([part[column] for part in parts]) for column in TAPE_COLUMNS}
+
+    def resample(self, symbol: str, start: float, end: float, granularity: str) -> typing.Dict[str, np.ndarray]:
+        """OHLCV arrays for every interval of the granularity (a TF_EQUIV key) that has at least one trade, oldest
+        first."""
+        interval = TF_EQUIV[granularity]
+        trades = self.query(symbol, start, end)
+
+        if len(trades['ts']) == 0:
+            return {field: np.array([]) for field in ['timestamp', 'open', 'high', 'low', 'close', 'volume']}
+
+        buckets = (trades['ts'] // interval).astype(np.int64) * interval
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(buckets)) + 1])
+        ends = np.concatenate([starts[1:], [len(buckets)]])
+
+        return {'timestamp': buckets[starts],
+                'open': trades['price'][starts],
+                'high': np.maximum.reduceat(trades['price'], starts),
+                'low': np.minimum.reduceat(trades['price'], starts),
+                'close': trades['price'][ends - 1],
+                'volume': np.add.reduceat(trades['size'], starts)}
+
+    def candles(self, symbol: str, granularity: str, start: float, end: float) -> typing.List[Candle]:
+        """Rebuilds Candle objects from the tape, newest first like the REST candles endpoint."""
+        ohlcv = self.resample(symbol, start, end, granularity)
+
+        candles = []
+        for i in range(len(ohlcv['timestamp']) - 1, -1, -1):
+            candles.append(Candle({'start': ohlcv['timestamp'][i], 'open': ohlcv['open'][i], 'high': ohlcv['high'][i],
+                                   'low': ohlcv['low'][i], 'close': ohlcv['close'][i],
+                                   'volume': ohlcv['volume'][i]}))
+        return candles
+
+    def vwap(self, symbol: str, start: float, end: float) -> typing.Optional[float]:
+        trades = self.query(symbol, start, end)
+        volume = trades['size'].sum()
+        if volume == 0:
+            return None
+        return float(np.dot(trades['price'], trades['size']) / volume)
+
+    def volume_profile(self, symbol: str, start: float, end: float, bins: int = 50) -> typing.Dict[str, np.ndarray]:
+        """Traded volume per price level: the bin edges and the total, buy and sell volume of each bin."""
+        trades = self.query(symbol, start, end)
+        if len(trades['price']) == 0:
+            return {'edges': np.array([]), 'volume': np.array([]), 'buy_volume': np.array([]),
+                    'sell_volume': np.array([])}
+
+        edges = np.histogram_bin_edges(trades['price'], bins=bins)
+        buys = trades['side'] == SIDES['BUY']
+
+        return {'edges': edges,
+                'volume': np.histogram(trades['price'], bins=edges, weights=trades['size'])[0],
+                'buy_volume': np.histogram(trades['price'][buys], bins=edges, weights=trades['size'][buys])[0],
+                'sell_volume': np.histogram(trades['price'][~buys], bins=edges, weights=trades['size'][~buys])[0]}
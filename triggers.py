@@ -0,0 +1,116 @@
+from models import *
+import heapq
+import itertools
+import math
+import threading
+import typing
+if typing.TYPE_CHECKING:
+    from strategies import Strategy
+
+# a trigger fires when the price goes to or above its level (UP) or to or below it (DOWN)
+UP = 'up'
+DOWN = 'down'
+
+
+class Trigger:
+    __slots__ = ('trade', 'strategy', 'kind', 'ticks', 'direction', 'active')
+
+    def __init__(self, trade: Trade, strategy: "Strategy", kind: str, ticks: int, direction: str):
+        self.trade = trade
+        self.strategy = strategy
+        # 'stop_loss' or 'take_profit'
+        self.kind = kind
+        self.ticks = ticks
+        self.direction = direction
+        self.active = True
+
+
+class TriggerIndex:
+    """Take profit and stop loss levels of every open trade, by symbol, in two heaps: a min-heap of the levels that
+    fire when the price goes up and a max-heap of the levels that fire when it goes down. Levels are integer ticks of
+    the asset so there's no float comparison at the boundary.
+
+    check() only looks at the top of the heaps and pops the levels the price crossed, a tick costs O(log n) per
+    trigger that fires and O(1) otherwise, however many exits are resting. Disarmed triggers are flagged and dropped
+    when they reach the top."""
+    def __init__(self):
+        # symbol -> [(ticks, sequence, trigger)]
+        self._up: typing.Dict[str, typing.List[typing.Tuple[int, int, Trigger]]] = dict()
+        # symbol -> [(-ticks, sequence, trigger)]
+        self._down: typing.Dict[str, typing.List[typing.Tuple[int, int, Trigger]]] = dict()
+        # entry_id -> armed triggers of the trade, all of them are disarmed when one fires
+        self._by_trade: typing.Dict[str, typing.List[Trigger]] = dict()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def arm(self, trade: Trade, strategy: "Strategy"):
+        """Adds the exit levels of a filled trade (see Strategy.exit_triggers), replacing the ones it already had."""
+        asset = trade.asset
+        triggers = []
+        for kind, price, direction in strategy.exit_triggers(trade):
+            # the price ticks that satisfy price >= level (UP) or price <= level (DOWN)
+            if direction == UP:
+                ticks = int(math.ceil(price / asset.quote_tick - 1e-9))
+            else:
+                ticks = int(math.floor(price / asset.quote_tick + 1e-9))
+            triggers.append(Trigger(trade, strategy, kind, ticks, direction))
+
+        with self._lock:
+            self._disarm(trade)
+            self._by_trade[trade.entry_id] = triggers
+            for trigger in triggers:
+                if trigger.direction == UP:
+                    heapq.heappush(self._up.setdefault(asset.symbol, []),
+                                   (trigger.ticks, next(self._sequence), trigger))
+                else:
+                    heapq.heappush(self._down.setdefault(asset.symbol, []),
+                                   (-trigger.ticks, next(self._sequence), trigger))
+
+    def disarm(self, trade: Trade):
+        with self._lock:
+            self._disarm(trade)
+
+    def _disarm(self, trade: Trade):
+        for trigger in self._by_trade.pop(trade.entry_id, []):
+            trigger.active = False
+
+    def check(self, asset: Asset, low: float, high: float = None) -> typing.List[Trigger]:
+        """Pops the triggers crossed by trades between low and high (the lowest and highest price of a batch of
+        trades, or the same price twice) and returns them, at most one per trade."""
+        low_ticks = asset.price_to_ticks(low)
+        high_ticks = asset.price_to_ticks(high) if high is not None else low_ticks
+
+        crossed: typing.Dict[str, Trigger] = dict()
+        with self._lock:
+            up = self._up.get(asset.symbol)
+            down = self._down.get(asset.symbol)
+            if not up and not down:
+                return []
+
+            while up and up[0][0] <= high_ticks:
+                self._cross(crossed, heapq.heappop(up)[2])
+            while down and -down[0][0] >= low_ticks:
+                self._cross(crossed, heapq.heappop(down)[2])
+
+            for trigger in crossed.values():
+                self._disarm(trigger.trade)
+
+            # drop the disarmed triggers sitting on top so the next check stays O(1)
+            while up and not up[0][2].active:
+                heapq.heappop(up)
+            while down and not down[0][2].active:
+                heapq.heappop(down)
+
+        return list(crossed.values())
+
+    @staticmethod
+    def _cross(crossed: typing.Dict[str, Trigger], trigger: Trigger):
+        if not trigger.active:
+            return
+        # a batch of trades wide enough to cross both levels of a trade counts as a stop loss
+        previous = crossed.get(trigger.trade.entry_id)
+        if previous is None or trigger.kind == 'stop_loss':
+            crossed[trigger.trade.entry_id] = trigger
+
+    def __len__(self) -> int:
+        return sum(len(triggers) for triggers in self._by_trade.values())